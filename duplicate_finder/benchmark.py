@@ -0,0 +1,362 @@
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from inventory import FILE_SUFFIXES, SQLITE_SUFFIXES, open_inventory
+from utils import DEFAULT_STAGES, IO_STRATEGIES, _run_stage, available_algorithms, compute_hash, new_hasher, scan_files
+
+
+# ==================================================================
+# Corpus sintético
+# ==================================================================
+def generate_corpus(root:Path, files=1000, min_size=1024, max_size=16*1024*1024, dup_ratio=0.2, header_ratio=0.1,
+                    header_size=256*1024, files_per_dir=100, seed=0):
+    """
+    Gera uma árvore de arquivos reproduzível para os benchmarks.
+
+    Os tamanhos seguem uma distribuição log-uniforme entre min_size e max_size.
+    Uma fração dos arquivos (dup_ratio) é cópia exata de um arquivo anterior e
+    outra fração (header_ratio) tem o mesmo tamanho e o mesmo cabeçalho de um
+    arquivo anterior, diferindo apenas no restante do conteúdo.
+
+    Returns:
+        dict: Parâmetros usados e totais gerados
+    """
+    rng = random.Random(seed)
+    root.mkdir(parents=True, exist_ok=True)
+    generated = []
+    stats = {"files": 0, "bytes": 0, "duplicates": 0, "header_collisions": 0}
+
+    for i in range(files):
+        path = root / f"d{i // files_per_dir:05d}" / f"f{i:07d}.bin"
+        path.parent.mkdir(exist_ok=True)
+        roll = rng.random()
+        if generated and roll < dup_ratio:
+            source = rng.choice(generated)
+            shutil.copyfile(source, path)
+            stats["duplicates"] += 1
+        elif generated and roll < dup_ratio + header_ratio:
+            source = rng.choice(generated)
+            size = source.stat().st_size
+            with open(source, "rb") as f:
+                header = f.read(min(size, header_size))
+            path.write_bytes(header + rng.randbytes(size - len(header)))
+            stats["header_collisions"] += 1
+        else:
+            size = int(math.exp(rng.uniform(math.log(min_size), math.log(max_size))))
+            path.write_bytes(rng.randbytes(size))
+        generated.append(path)
+        stats["files"] += 1
+        stats["bytes"] += path.stat().st_size
+
+    return {"params": {"files": files, "min_size": min_size, "max_size": max_size, "dup_ratio": dup_ratio,
+                       "header_ratio": header_ratio, "header_size": header_size, "seed": seed}, **stats}
+
+
+# ==================================================================
+# Benchmarks
+# ==================================================================
+def bench_algorithms(algorithms, size_mb=256, chunk_size=1024*1024, repeat=3):
+    """
+    Mede a vazão de cada algoritmo de hash sobre dados em memória, sem I/O.
+
+    Args:
+        algorithms ([str]): Algoritmos a medir
+        size_mb=256 (int): Quantidade de dados processada por repetição, em MB
+        chunk_size=1024*1024 (int): Tamanho dos blocos passados a update()
+        repeat=3 (int): Repetições; é considerada a mais rápida
+
+    Returns:
+        dict: Algoritmo -> vazão em MB/s
+    """
+    chunk = os.urandom(chunk_size)
+    chunks = size_mb * 1024 * 1024 // chunk_size
+    results = {}
+    for alg in algorithms:
+        best = None
+        for _ in range(repeat):
+            hasher = new_hasher(alg)
+            start = time.perf_counter()
+            for _ in range(chunks):
+                hasher.update(chunk)
+            hasher.hexdigest()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        results[alg] = chunks * chunk_size / (1024 * 1024) / best
+    return results
+
+
+def bench_files(algorithms, path, repeat=3):
+    """
+    Mede a vazão de compute_hash sobre um arquivo (inclui leitura, normalmente do cache de páginas).
+
+    Returns:
+        dict: Algoritmo -> vazão em MB/s
+    """
+    size = os.path.getsize(path)
+    results = {}
+    for alg in algorithms:
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            compute_hash(path, alg=alg)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        results[alg] = size / (1024 * 1024) / best
+    return results
+
+
+def bench_io(path, strategies, alg="md5", chunk_sizes=(None,), repeat=3):
+    """
+    Compara as estratégias de leitura de compute_hash sobre um arquivo local.
+
+    Args:
+        path (str): Arquivo a ler
+        strategies ([str]): Estratégias de leitura (ver IO_STRATEGIES)
+        alg="md5" (str): Algoritmo de hash usado em todas as medições
+        chunk_sizes=(None,) ([int]): Tamanhos de bloco a combinar; None usa o tamanho adaptativo
+        repeat=3 (int): Repetições; é considerada a mais rápida
+
+    Returns:
+        dict: "estratégia/bloco" -> vazão em MB/s
+    """
+    size = os.path.getsize(path)
+    results = {}
+    for io in strategies:
+        for chunk_size in chunk_sizes:
+            best = None
+            for _ in range(repeat):
+                start = time.perf_counter()
+                compute_hash(path, alg=alg, chunk_size=chunk_size, io=io)
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            label = f"{io}/{'adapt' if chunk_size is None else str(chunk_size // 1024) + 'K'}"
+            results[label] = size / (1024 * 1024) / best
+    return results
+
+
+def bench_pipeline(root:Path, alg="md5", stages=None, workers=1, backend="thread", io="auto", inventory_formats=(".json",)):
+    """
+    Cronometra cada etapa do pipeline de find_duplicates sobre um diretório.
+
+    Mede a varredura, o agrupamento por tamanho, cada etapa de hash e a
+    gravação e leitura do inventário em cada formato informado. Os hashes são
+    sempre calculados do zero (inventário novo a cada execução).
+
+    Returns:
+        dict: Tempos (segundos) e contagens por etapa
+    """
+    stages = [s for s in (stages or DEFAULT_STAGES) if s != "full"] + ["full"]
+    results = {}
+    workdir = Path(tempfile.mkdtemp(prefix="dupfinder-bench-"))
+    try:
+        inventory = open_inventory(pre_path=root)
+
+        start = time.perf_counter()
+        entries = list(scan_files(root))
+        results["scan"] = {"seconds": time.perf_counter() - start, "files": len(entries)}
+
+        start = time.perf_counter()
+        inventory.begin_scan()
+        for path, stat in entries:
+            inventory.add_item(path, stat)
+        inventory.end_scan()
+        groups = [list(flist) for _, flist in inventory.get_by_size_list() if len(flist) > 1]
+        results["size_grouping"] = {"seconds": time.perf_counter() - start, "groups": len(groups),
+                                    "candidates": sum(len(g) for g in groups)}
+
+        for stage in stages:
+            start = time.perf_counter()
+            groups, stats = _run_stage(groups, stage, alg, inventory, workers, backend, io, False)
+            results[f"hash_{stage}"] = {"seconds": time.perf_counter() - start, "groups": len(groups), **stats}
+
+        for suffix in inventory_formats:
+            inventory_file = workdir / f"inventory{suffix}"
+            if suffix in SQLITE_SUFFIXES:
+                # Só a gravação é cronometrada, como nos demais formatos: os
+                # registros são inseridos antes, e o checkpoint leva o conteúdo
+                # do WAL para o arquivo principal, cujo tamanho é medido
+                target = open_inventory(inventory_file, pre_path=root)
+                for path, stat in entries:
+                    target.add_item(path, stat)
+                    target.update_item(path, **inventory.get_item(path))
+                start = time.perf_counter()
+                target.record_file_inventory()
+                target.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+                save = time.perf_counter() - start
+                target.conn.close()
+            else:
+                inventory.inventory_file = inventory_file
+                start = time.perf_counter()
+                inventory.record_file_inventory()
+                save = time.perf_counter() - start
+                inventory.inventory_file = None
+
+            start = time.perf_counter()
+            loaded = open_inventory(inventory_file, pre_path=root)
+            groups_loaded = sum(1 for _, flist in loaded.get_by_size_list() if len(flist) > 1)
+            load = time.perf_counter() - start
+            results[f"inventory{suffix}"] = {"save_seconds": save, "load_seconds": load, "size_groups": groups_loaded,
+                                             "bytes": inventory_file.stat().st_size}
+            if getattr(loaded, "journal", None) is not None:
+                loaded.journal.close()
+            if getattr(loaded, "conn", None) is not None:
+                loaded.conn.close()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def best_of(runs):
+    """ Combina repetições de bench_pipeline: o menor tempo de cada etapa e as contagens da primeira """
+    best = {stage: dict(values) for stage, values in runs[0].items()}
+    for run in runs[1:]:
+        for stage, values in run.items():
+            for key, value in values.items():
+                if key.endswith("seconds"):
+                    best[stage][key] = min(best[stage][key], value)
+    return best
+
+
+def compare_results(current:dict, baseline:dict, threshold=0.1, noise_floor=0.05):
+    """
+    Compara os tempos de duas execuções do benchmark de pipeline.
+
+    Uma etapa só é regressão se ficar mais lenta que o limite (fração) e se o
+    aumento passar de noise_floor segundos: etapas de poucos milissegundos
+    variam mais que qualquer limite percentual entre execuções idênticas.
+
+    Returns:
+        [str]: Etapas que ficaram mais lentas que o limite (fração) em relação à base
+    """
+    regressions = []
+    for stage, values in current.get("pipeline", {}).items():
+        base = baseline.get("pipeline", {}).get(stage)
+        if not base:
+            continue
+        for key, value in values.items():
+            if not key.endswith("seconds") or not base.get(key):
+                continue
+            ratio = value / base[key]
+            flag = ""
+            if ratio > 1 + threshold and value - base[key] > noise_floor:
+                flag = "  <-- REGRESSÃO"
+                regressions.append(f"{stage}.{key}")
+            print(f"  {stage + '.' + key:<32} {base[key]:>10.4f}s -> {value:>10.4f}s ({ratio:>5.2f}x){flag}")
+    return regressions
+
+
+def print_results(title, results):
+    print(title)
+    for alg, mbps in sorted(results.items(), key=lambda r: r[1], reverse=True):
+        print(f"  {alg:<16} {mbps:>10.1f} MB/s")
+
+
+# ==================================================================
+# CLI
+# ==================================================================
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de hash e leitura do Duplicate File Finder")
+
+    parser.add_argument("-m", "--mode", choices=["alg", "io", "pipeline", "all"], default="all", help="alg = compara algoritmos de hash; io = compara estratégias de leitura; pipeline = cronometra as etapas de find_duplicates sobre um corpus sintético; all = alg e io (padrão: all)")
+    parser.add_argument("-a", "--alg", nargs="*", default=available_algorithms(), choices=available_algorithms(), help="Algoritmos a medir (padrão: todos os disponíveis). Nos modos io e pipeline é usado o primeiro")
+    parser.add_argument("--io", nargs="*", default=IO_STRATEGIES, choices=IO_STRATEGIES, help="Estratégias de leitura a medir no modo io (padrão: todas). No modo pipeline é usada a primeira")
+    parser.add_argument("--chunk", nargs="*", type=int, default=[0, 64, 1024, 8192], metavar="KB", help="Tamanhos de bloco, em KB, a medir no modo io; 0 = adaptativo (padrão: 0 64 1024 8192)")
+    parser.add_argument("-s", "--size", type=int, default=256, metavar="MB", help="Quantidade de dados por repetição, em MB (padrão: 256)")
+    parser.add_argument("-r", "--repeat", type=int, default=3, help="Repetições por medição; é considerada a mais rápida (padrão: 3)")
+    parser.add_argument("-f", "--file", default=None, help="Arquivo local a ler. Se omitido, é usado um arquivo temporário do tamanho informado")
+    # Modo pipeline
+    parser.add_argument("--corpus", default=None, metavar="DIR", help="Diretório do corpus sintético; é gerado se não existir. Se omitido, é usado um diretório temporário")
+    parser.add_argument("--files", type=int, default=1000, help="Quantidade de arquivos do corpus (padrão: 1000)")
+    parser.add_argument("--min-size", type=int, default=1, metavar="KB", help="Tamanho mínimo dos arquivos, em KB (padrão: 1)")
+    parser.add_argument("--max-size", type=int, default=16384, metavar="KB", help="Tamanho máximo dos arquivos, em KB (padrão: 16384)")
+    parser.add_argument("--dup-ratio", type=float, default=0.2, help="Fração de arquivos que são cópias exatas (padrão: 0.2)")
+    parser.add_argument("--header-ratio", type=float, default=0.1, help="Fração de arquivos com mesmo tamanho e cabeçalho de outro, mas conteúdo diferente (padrão: 0.1)")
+    parser.add_argument("--seed", type=int, default=0, help="Semente do gerador do corpus (padrão: 0)")
+    parser.add_argument("--workers", type=int, default=1, help="Workers para cálculo dos hashes no modo pipeline (padrão: 1)")
+    parser.add_argument("--inventory-formats", nargs="*", default=FILE_SUFFIXES + SQLITE_SUFFIXES[:1], help="Formatos de inventário a cronometrar no modo pipeline (padrão: todos)")
+    # Resultados
+    parser.add_argument("-o", "--output", default=None, metavar="JSON", help="Grava os resultados em JSON")
+    parser.add_argument("--compare", default=None, metavar="JSON", help="Compara o modo pipeline com resultados gravados anteriormente e encerra com erro se houver regressão")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Aumento de tempo tolerado na comparação, em fração (padrão: 0.1)")
+    parser.add_argument("--noise-floor", type=float, default=50, metavar="MS", help="Aumentos de tempo menores que este valor, em milissegundos, não são considerados regressão (padrão: 50)")
+
+    args = parser.parse_args()
+
+    report = {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": sys.version.split()[0],
+              "platform": platform.platform(), "cpus": os.cpu_count()}
+
+    if args.mode in ["alg", "all"]:
+        report["alg_memory"] = bench_algorithms(args.alg, args.size, repeat=args.repeat)
+        print_results("Vazão em memória (apenas hash):", report["alg_memory"])
+
+    if args.mode in ["alg", "io", "all"]:
+        with tempfile.NamedTemporaryFile() as tmp:
+            path = args.file
+            if path is None:
+                for _ in range(args.size):
+                    tmp.write(os.urandom(1024 * 1024))
+                tmp.flush()
+                path = tmp.name
+
+            if args.mode in ["alg", "all"]:
+                report["alg_file"] = bench_files(args.alg, path, repeat=args.repeat)
+                print_results(f"Vazão de compute_hash por algoritmo ({path}):", report["alg_file"])
+            if args.mode in ["io", "all"]:
+                chunk_sizes = [c * 1024 if c else None for c in args.chunk]
+                report["io"] = bench_io(path, args.io, alg=args.alg[0], chunk_sizes=chunk_sizes, repeat=args.repeat)
+                print_results(f"Vazão de compute_hash por estratégia de leitura ({args.alg[0]}, {path}):", report["io"])
+
+    regressions = []
+    if args.mode == "pipeline":
+        tmpdir = None
+        corpus = Path(args.corpus) if args.corpus else None
+        if corpus is None:
+            tmpdir = tempfile.mkdtemp(prefix="dupfinder-corpus-")
+            corpus = Path(tmpdir)
+        try:
+            if not corpus.exists() or not any(corpus.iterdir()):
+                print(f"Gerando corpus em {corpus}..")
+                report["corpus"] = generate_corpus(corpus, files=args.files, min_size=args.min_size * 1024, max_size=args.max_size * 1024,
+                                                   dup_ratio=args.dup_ratio, header_ratio=args.header_ratio, seed=args.seed)
+            else:
+                report["corpus"] = {"path": str(corpus), "reused": True}
+            # O pipeline é executado --repeat vezes e vale o menor tempo de cada etapa
+            runs = [bench_pipeline(corpus, alg=args.alg[0], workers=args.workers, io=args.io[0],
+                                   inventory_formats=args.inventory_formats) for _ in range(args.repeat)]
+            report["pipeline"] = best_of(runs)
+            report["repeat"] = args.repeat
+        finally:
+            if tmpdir:
+                shutil.rmtree(tmpdir, ignore_errors=True)
+
+        print(f"Tempos por etapa (menor de {args.repeat} execuções):")
+        for stage, values in report["pipeline"].items():
+            print(f"  {stage:<20} " + ", ".join(f"{k}={v:.4f}" if isinstance(v, float) else f"{k}={v}" for k, v in values.items()))
+
+        if args.compare:
+            with open(args.compare, "r", encoding="utf-8") as f:
+                baseline = json.load(f)
+            print(f"Comparação com {args.compare}:")
+            regressions = compare_results(report, baseline, args.threshold, args.noise_floor / 1000)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=4, ensure_ascii=False)
+        print(f"Resultados gravados em {args.output}")
+
+    if regressions:
+        print(f"Regressões encontradas: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,40 @@
 import csv
 import json
 import logging
+import os
+import sqlite3
+import sys
+import time
 from collections import defaultdict
+from itertools import groupby
+from operator import itemgetter
 from pathlib import Path
 
 
+SQLITE_SUFFIXES = ['.sqlite', '.sqlite3']
+FILE_SUFFIXES = ['.csv', '.json', '.jsonl']
+
+# O diário é sincronizado em disco a cada JOURNAL_SYNC_RECORDS registros ou
+# JOURNAL_SYNC_SECONDS segundos, o que ocorrer primeiro
+JOURNAL_SYNC_RECORDS = 1000
+JOURNAL_SYNC_SECONDS = 5.0
+
+
+def open_inventory(inventory_file:Path=None, pre_path:Path=None):
+    """ Abre o inventário no formato indicado pela extensão do arquivo """
+    if inventory_file and inventory_file.suffix.lower() in SQLITE_SUFFIXES:
+        return SqliteInventory(inventory_file, pre_path=pre_path)
+    return Inventory(inventory_file, pre_path=pre_path)
+
+
 class Inventory(object):
+    # Campos gravados para cada arquivo. mtime_ns, ino e dev permitem detectar
+    # alterações em uma nova varredura sem recalcular os hashes
+    FIELDS = ["size", "mtime_ns", "ino", "dev", "hash_fast", "hash_tail", "hash_mid", "hash_full", "alg"]
+    INT_FIELDS = ["size", "mtime_ns", "ino", "dev"]
+    # Hashes das etapas progressivas (início, fim, amostras do meio e completo)
+    HASH_FIELDS = ["hash_fast", "hash_tail", "hash_mid", "hash_full"]
+
     def __init__(self, inventory_file:Path=None, pre_path:Path=None):
         self.logger=logging.getLogger("duplicate_finder")
 
@@ -14,12 +43,72 @@ class Inventory(object):
         self.by_size = None
         self.by_hash_fast = None
         self.by_hash_full = None
+        self.seen = None
+        self.scan_stats = None
+        self.journal = None
+        self.journal_pending = 0
+        self.journal_synced_at = time.monotonic()
+        replayed = 0
         if inventory_file:
             self.inventory = self.load_file_inventory(inventory_file)
+            replayed = self._replay_journal()
         else:
             self.inventory = dict()
         self.create_indexes()
-        
+
+        if inventory_file:
+            self.journal = open(self.journal_file(), "a", encoding="utf-8")
+            # Alterações recuperadas de uma execução interrompida são consolidadas no arquivo principal
+            if replayed:
+                self.record_file_inventory()
+
+
+    def journal_file(self) -> Path:
+        """ Diário de alterações (JSON Lines) gravado ao lado do arquivo de inventário """
+        return self.inventory_file.with_name(self.inventory_file.name + ".journal")
+
+
+    def _replay_journal(self):
+        """
+        Aplica ao inventário carregado as alterações registradas no diário por
+        uma execução que não chegou a gravar o arquivo principal.
+
+        Returns:
+            int: Quantidade de registros aplicados
+        """
+        journal_file = self.journal_file()
+        if not journal_file.exists():
+            return 0
+        count = 0
+        with open(journal_file, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # Última linha incompleta: a execução foi interrompida durante a escrita
+                    self.logger.warning("Registro incompleto ignorado no diário de inventário")
+                    break
+                if record.get("deleted"):
+                    self.inventory.pop(record["path"], None)
+                else:
+                    self.inventory[record["path"]] = FileRecord(record["path"], record["item"])
+                count += 1
+        if count:
+            self.logger.info(f"Diário de inventário recuperado: {count} alterações aplicadas")
+        return count
+
+
+    def _journal_write(self, path_key:str):
+        """ Registra no diário o estado atual da entrada (ou sua remoção) """
+        if self.journal is None:
+            return
+        item = self.inventory.get(path_key)
+        record = {"path": path_key, "deleted": True} if item is None else {"path": path_key, "item": item.to_dict()}
+        self.journal.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.journal_pending += 1
+        if self.journal_pending >= JOURNAL_SYNC_RECORDS or time.monotonic() - self.journal_synced_at >= JOURNAL_SYNC_SECONDS:
+            self.flush()
+
     
     @staticmethod
     def load_file_inventory(inventory_path:Path, logger=logging.getLogger("duplicate_finder")):
@@ -28,8 +117,8 @@ class Inventory(object):
         inventory = dict()
 
         # Verifica se o tipo do arquivo é compatível
-        if inventory_path.suffix.lower() not in ['.csv', '.json']:
-            raise ValueError("O formato do arquivo não foi reconhecido, deve ser informado um arquivo CSV ou JSON")
+        if inventory_path.suffix.lower() not in FILE_SUFFIXES:
+            raise ValueError("O formato do arquivo não foi reconhecido, deve ser informado um arquivo CSV, JSON, JSONL ou SQLite")
 
         # Verifica se o arquivo existe
         if not inventory_path.exists():
@@ -39,125 +128,242 @@ class Inventory(object):
         # Carrega CSV
         if inventory_path.suffix.lower() == '.csv':
             with open(inventory_path, "r", encoding="utf-8") as csvfile:
-                reader = csv.reader(csvfile)
+                reader = csv.DictReader(csvfile)
                 for row in reader:
-                    if row[0] == "path":
-                        continue
-                    inventory[row[0]] = {"size": row[1], "hash_fast": row[2], "hash_full": row[3], "alg": row[4]}
+                    item = {}
+                    for field in Inventory.FIELDS:
+                        # Colunas vazias ou ausentes (inventários antigos) são ignoradas
+                        if row.get(field):
+                            item[field] = int(row[field]) if field in Inventory.INT_FIELDS else row[field]
+                    inventory[row["path"]] = FileRecord(row["path"], item)
         # Carrega JSON
         elif inventory_path.suffix.lower() == '.json':
             with open(inventory_path, "r", encoding="utf-8") as jsonfile:
                 inventory = json.load(jsonfile)
-            
+            for k, item in inventory.items():
+                inventory[k] = FileRecord(k, item)
+        # Carrega JSON Lines (um registro por linha)
+        elif inventory_path.suffix.lower() == '.jsonl':
+            with open(inventory_path, "r", encoding="utf-8") as jsonlfile:
+                for line in jsonlfile:
+                    item = json.loads(line)
+                    path_key = item.pop("path")
+                    inventory[path_key] = FileRecord(path_key, item)
         
         logger.info(f"Inventário recuperado. {len(inventory.keys())} registros encontrados.")
         return inventory
         
 
     def record_file_inventory(self):
+        """
+        Grava o inventário completo e esvazia o diário.
+
+        O arquivo é escrito com um nome temporário e renomeado ao final, de modo
+        que uma interrupção durante a gravação preserva o arquivo anterior.
+        """
         self.logger.info(f"Gravando inventário em {self.inventory_file}")
 
         if not self.inventory_file:
             raise ValueError("Não foi informado arquivo de inventário, favor verificar")
 
-        # Grava CSV
-        if self.inventory_file.suffix.lower() == ".csv":
-            with open(self.inventory_file, "w", newline="", encoding="utf-8") as csvfile:
-                writer = csv.writer(csvfile)
-                writer.writerow(["path", "size", "hash_fast", "hash_full", "alg"])
-                for k in self.inventory.keys():
-                    writer.writerow(
-                        [k], # path
-                        self.inventory[k]['size'], # size
-                        self.inventory[k]["hash_fast"] if "hash_fast" in self.inventory[k].keys() else None, # hash_fast
-                        self.inventory[k]["hash_full"] if "hash_full" in self.inventory[k].keys() else None, # hash_full
-                        self.inventory[k]["alg"] if "alg" in self.inventory[k].keys() else None # alg
-                        )
-            self.logger.info(f"Inventário CSV salvo em {self.inventory_file}")
-
-        # Grava JSON
-        elif self.inventory_file.suffix.lower() == ".json":
-            with open(self.inventory_file, "w", encoding="utf-8") as jsonfile:
-                json.dump(self.inventory, jsonfile, indent=4, ensure_ascii=False)
-            self.logger.info(f"Inventário JSON salvo em {self.inventory_file}")
+        suffix = self.inventory_file.suffix.lower()
+        if suffix not in FILE_SUFFIXES:
+            raise ValueError("O formato do arquivo não foi reconhecido, deve ser informado um arquivo CSV, JSON, JSONL ou SQLite")
 
-        else:
-            raise ValueError("O formato do arquivo não foi reconhecido, deve ser informado um arquivo CSV ou JSON")
+        tmp_file = self.inventory_file.with_name(f".{self.inventory_file.name}.tmp")
+        with open(tmp_file, "w", newline="", encoding="utf-8") as f:
+            # Grava CSV
+            if suffix == ".csv":
+                writer = csv.writer(f)
+                writer.writerow(["path"] + Inventory.FIELDS)
+                for k, item in self.inventory.items():
+                    writer.writerow([k] + [item.get(field) for field in Inventory.FIELDS])
+
+            # Grava JSON
+            elif suffix == ".json":
+                json.dump({k: item.to_dict() for k, item in self.inventory.items()}, f, indent=4, ensure_ascii=False)
+
+            # Grava JSON Lines, um registro por vez
+            elif suffix == ".jsonl":
+                for k, item in self.inventory.items():
+                    f.write(json.dumps({"path": k, **item.to_dict()}, ensure_ascii=False) + "\n")
+
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.inventory_file)
+        self.logger.info(f"Inventário {suffix[1:].upper()} salvo em {self.inventory_file}")
+
+        # As alterações do diário já estão no arquivo principal
+        if self.journal is not None:
+            self.journal.seek(0)
+            self.journal.truncate()
+            self.flush()
     
     
     def create_indexes(self):
-        self.by_size = defaultdict(list)
-        self.by_hash_fast = defaultdict(list)
-        self.by_hash_full = defaultdict(list)
+        # Os índices guardam conjuntos de chaves: inclusão, troca de grupo e
+        # remoção custam O(1), mesmo em grupos com milhares de arquivos
+        self.by_size = defaultdict(set)
+        self.by_hash_fast = defaultdict(set)
+        self.by_hash_full = defaultdict(set)
+        self.indexes = {"size": self.by_size, "hash_fast": self.by_hash_fast, "hash_full": self.by_hash_full}
+
+        for k, item in self.inventory.items():
+            for field, index in self.indexes.items():
+                value = item.get(field)
+                if value is not None:
+                    index[value].add(item.key)
 
-        for k in self.inventory.keys():
-            self.by_size[self.inventory[k]['size']].append(k)
-            if 'hash_fast' in self.inventory[k].keys():
-                self.by_hash_fast[self.inventory[k]['hash_fast']].append(k)
-            if 'hash_full' in self.inventory[k].keys():
-                self.by_hash_full[self.inventory[k]['hash_full']].append(k)
+
+    def _index_discard(self, field:str, value, path_key:str):
+        """ Remove a chave do grupo, descartando grupos vazios """
+        group = self.indexes[field].get(value)
+        if group is not None:
+            group.discard(path_key)
+            if not group:
+                del self.indexes[field][value]
 
 
     def path_to_key(self, path:Path) -> str:
+        # Sem pre_path (varredura de vários diretórios) a chave é o caminho
+        # absoluto, que identifica a raiz de cada arquivo sem ambiguidade
         if self.pre_path and path.is_relative_to(self.pre_path):
             path = path.relative_to(self.pre_path)
         return str(path)
 
 
-    def add_item(self, path:Path):
+    def key_to_path(self, path_key:str) -> Path:
+        if self.pre_path:
+            return self.pre_path / Path(path_key)
+        return Path(path_key)
+
+
+    def begin_scan(self):
+        """ Inicia uma varredura: arquivos não vistos até end_scan serão removidos """
+        self.seen = set()
+        self.scan_stats = {"new": 0, "unchanged": 0, "changed": 0, "removed": 0}
+
+
+    def end_scan(self):
+        """
+        Finaliza a varredura iniciada em begin_scan, removendo do inventário os
+        arquivos que não foram encontrados.
+
+        Returns:
+            dict: Contagem de arquivos novos, inalterados, alterados e removidos
+        """
+        if self.scan_stats is None:
+            raise RuntimeError("end_scan chamado sem begin_scan")
+        for path_key in [k for k in self.inventory.keys() if k not in self.seen]:
+            self.remove_item(self.key_to_path(path_key))
+            self.scan_stats["removed"] += 1
+        stats = self.scan_stats
+        self.seen = None
+        self.scan_stats = None
+        return stats
+
+
+    def _mark_seen(self, path_key:str):
+        self.seen.add(path_key)
+
+
+    def _new_item(self, path_key:str):
+        self.inventory[path_key] = FileRecord(path_key)
+
+
+    def add_item(self, path:Path, stat:os.stat_result=None):
+        """
+        Adiciona um arquivo ao inventário, ou revalida um arquivo já conhecido.
+
+        Se tamanho, mtime, inode ou device mudaram desde a última varredura, os
+        hashes gravados são descartados para que o arquivo seja recalculado.
+
+        Args:
+            path (Path): Caminho do arquivo
+            stat=None (os.stat_result): Resultado de stat já obtido, evita nova chamada
+
+        Returns:
+            str: "new", "unchanged" ou "changed"; None se o arquivo estiver inacessível
+        """
         try:
-            size = path.stat().st_size
-            path_key = self.path_to_key(path)
-            if path_key not in self.inventory.keys():
-                self.inventory[path_key] = {}
-                self.inventory[path_key]['size'] = size
-                self.by_size[size].append(path_key)
+            if stat is None:
+                stat = path.stat()
         except FileNotFoundError:
             self.logger.warning(f"Arquivo {path} inacessível.")
+            return None
+
+        path_key = self.path_to_key(path)
+        if self.scan_stats is not None:
+            self._mark_seen(path_key)
+
+        item = self.get_item(path)
+        if item is None:
+            self._new_item(path_key)
+            status = "new"
+        elif (item.get("size") == stat.st_size and item.get("mtime_ns") == stat.st_mtime_ns
+              and item.get("ino") == stat.st_ino and item.get("dev") == stat.st_dev):
+            status = "unchanged"
+        else:
+            self.clear_hashes(path)
+            status = "changed"
+
+        if status != "unchanged":
+            self.update_item(path, size=stat.st_size, mtime_ns=stat.st_mtime_ns, ino=stat.st_ino, dev=stat.st_dev)
+
+        if self.scan_stats is not None:
+            self.scan_stats[status] += 1
+        return status
+
+
+    def clear_hashes(self, path:Path):
+        """ Descarta os hashes gravados para o arquivo """
+        item = self.inventory[self.path_to_key(path)]
+        for field in Inventory.HASH_FIELDS + ["alg"]:
+            if field in self.indexes.keys() and field in item:
+                self._index_discard(field, item[field], item.key)
+            setattr(item, field, None)
+        self._journal_write(item.key)
+
+
+    def get_item(self, path:Path):
+        return self.inventory.get(self.path_to_key(path))
 
 
     def remove_item(self, path:Path):
         path_key = self.path_to_key(path)
-        if path_key in self.inventory.keys():
-            self.by_size[self.inventory[path_key]['size']].remove(path_key)
-            if 'hash_fast' in self.inventory[path_key].keys():
-                self.by_hash_fast[self.inventory[path_key]['hash_fast']].remove(path_key)
-            if 'hash_full' in self.inventory[path_key].keys():
-                self.by_hash_full[self.inventory[path_key]['hash_full']].remove(path_key)
-            self.inventory.pop(path_key)
-        else:
+        item = self.inventory.pop(path_key, None)
+        if item is None:
             self.logger.warning(f"Arquivo {path_key} não está no inventário")
+            return
+        for field in self.indexes.keys():
+            if field in item:
+                self._index_discard(field, item[field], path_key)
+        self._journal_write(path_key)
     
     
-    def update_item(self, path:Path, size:int=None, hash_fast:str=None, hash_full:str=None, alg:str=None):
-        path_key = self.path_to_key(path)
+    def update_item(self, path:Path, size:int=None, hash_fast:str=None, hash_full:str=None, alg:str=None,
+                    mtime_ns:int=None, ino:int=None, dev:int=None, hash_tail:str=None, hash_mid:str=None):
+        item = self.inventory[self.path_to_key(path)]
+        # A chave guardada no registro é a instância compartilhada com os índices
+        path_key = item.key
 
-        if size:
-            prev_size = self.inventory[path_key]['size'] if 'size' in self.inventory[path_key].keys() else None
-            if prev_size and prev_size != size and path_key in self.by_size[prev_size]:
-                self.by_size[prev_size].pop(path_key)
-            if path_key not in self.by_size[size]:
-                self.by_size[size].append(path_key)
-            self.inventory[path_key]['size'] = size
-
-        if hash_fast:
-            prev_hash_fast = self.inventory[path_key]['hash_fast'] if 'hash_fast' in self.inventory[path_key].keys() else None
-            if prev_hash_fast and prev_hash_fast != hash_fast and path_key in self.by_hash_fast[prev_hash_fast]:
-                self.by_hash_fast[prev_hash_fast].pop(path_key)
-            if path_key not in self.by_hash_fast[hash_fast]:
-                self.by_hash_fast[hash_fast].append(path_key)
-            self.inventory[path_key]['hash_fast'] = hash_fast
-
-        if hash_full:
-            prev_hash_full = self.inventory[path_key]['hash_full'] if 'hash_full' in self.inventory[path_key].keys() else None
-            if prev_hash_full and prev_hash_full != hash_full and path_key in self.by_hash_full[prev_hash_full]:
-                self.by_hash_full[prev_hash_full].pop(path_key)
-            if path_key not in self.by_hash_full[hash_full]:
-                self.by_hash_full[hash_full].append(path_key)
-            self.inventory[path_key]['hash_full'] = hash_full
+        for field, value in (("mtime_ns", mtime_ns), ("ino", ino), ("dev", dev), ("hash_tail", hash_tail), ("hash_mid", hash_mid)):
+            if value is not None:
+                setattr(item, field, value)
+
+        for field, value in (("size", size), ("hash_fast", hash_fast), ("hash_full", hash_full)):
+            if value is None:
+                continue
+            prev_value = item.get(field)
+            if prev_value is not None and prev_value != value:
+                self._index_discard(field, prev_value, path_key)
+            self.indexes[field][value].add(path_key)
+            setattr(item, field, value)
 
         if alg:
-            self.inventory[path_key]['alg'] = alg
+            item.alg = sys.intern(alg)
+
+        self._journal_write(path_key)
 
     
     def has_item(self, path):
@@ -165,6 +371,15 @@ class Inventory(object):
         return path_key in self.inventory.keys()
 
 
+    def get_by_size(self, size:int):
+        """ Chaves dos arquivos com o tamanho informado """
+        return list(self.by_size.get(size, ()))
+
+
+    def __len__(self):
+        return len(self.inventory)
+
+
     def get_by_size_list(self):
         return self.by_size.items()
     
@@ -177,5 +392,220 @@ class Inventory(object):
         return self.by_hash_full.items()
 
 
+    def flush(self):
+        """ Sincroniza o diário em disco; o inventário completo só é gravado em record_file_inventory """
+        if self.journal is not None:
+            self.journal.flush()
+            os.fsync(self.journal.fileno())
+        self.journal_pending = 0
+        self.journal_synced_at = time.monotonic()
+
+
+    def __str__(self):
+        return json.dumps({k: item.to_dict() for k, item in self.inventory.items()}, indent=4, ensure_ascii=False)
+
+
+class FileRecord(object):
+    """
+    Registro de um arquivo no inventário em memória.
+
+    Com __slots__ cada registro é um objeto de tamanho fixo, sem o dict por
+    arquivo, o que reduz a memória de inventários com milhões de arquivos.
+    Para leitura se comporta como o dict devolvido pelo SqliteInventory
+    (get, [], in, keys), contendo apenas os campos preenchidos.
+    """
+    __slots__ = ["key"] + Inventory.FIELDS
+
+    def __init__(self, key:str, values:dict=None):
+        self.key = key
+        values = values or {}
+        for field in Inventory.FIELDS:
+            setattr(self, field, values.get(field))
+        # Poucos algoritmos distintos: a mesma string é compartilhada por todos os registros
+        if self.alg is not None:
+            self.alg = sys.intern(self.alg)
+
+
+    def get(self, field:str, default=None):
+        value = getattr(self, field) if field in Inventory.FIELDS else None
+        return default if value is None else value
+
+
+    def __getitem__(self, field:str):
+        value = self.get(field)
+        if value is None:
+            raise KeyError(field)
+        return value
+
+
+    def __contains__(self, field:str):
+        return self.get(field) is not None
+
+
+    def keys(self):
+        return [field for field in Inventory.FIELDS if getattr(self, field) is not None]
+
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in self.keys()}
+
+
+class SqliteInventory(Inventory):
+    """
+    Inventário gravado em SQLite.
+
+    Os registros ficam no banco e são consultados sob demanda, com índices por
+    tamanho e por hash, de modo que o inventário completo nunca é carregado em
+    memória. As escritas são agrupadas em transações de BATCH_SIZE operações ou
+    JOURNAL_SYNC_SECONDS segundos, o que ocorrer primeiro.
+    """
+    BATCH_SIZE = 10000
+
+    def __init__(self, inventory_file:Path, pre_path:Path=None):
+        self.logger=logging.getLogger("duplicate_finder")
+
+        self.inventory_file = inventory_file
+        self.pre_path = pre_path
+        self.seen = None
+        self.scan_stats = None
+        self.pending = 0
+        self.committed_at = time.monotonic()
+
+        self.logger.info(f"Abrindo inventário SQLite em {inventory_file}")
+        self.conn = sqlite3.connect(inventory_file)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.create_indexes()
+        count = self.conn.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+        self.logger.info(f"Inventário recuperado. {count} registros encontrados.")
+
+
+    def create_indexes(self):
+        columns = ", ".join(f"{field} {'INTEGER' if field in Inventory.INT_FIELDS else 'TEXT'}" for field in Inventory.FIELDS)
+        self.conn.execute(f"CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, {columns})")
+        # Inventários criados por versões anteriores recebem as colunas novas
+        existing = {row[1] for row in self.conn.execute("PRAGMA table_info(files)")}
+        for field in Inventory.FIELDS:
+            if field not in existing:
+                self.conn.execute(f"ALTER TABLE files ADD COLUMN {field} {'INTEGER' if field in Inventory.INT_FIELDS else 'TEXT'}")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_files_size ON files (size)")
+        for field in ["hash_fast", "hash_full"]:
+            self.conn.execute(f"CREATE INDEX IF NOT EXISTS idx_files_{field} ON files ({field})")
+        self.conn.commit()
+
+
+    def _write(self, sql:str, params=()):
+        cursor = self.conn.execute(sql, params)
+        self.pending += 1
+        if self.pending >= SqliteInventory.BATCH_SIZE or time.monotonic() - self.committed_at >= JOURNAL_SYNC_SECONDS:
+            self.flush()
+        return cursor
+
+
+    def flush(self):
+        self.conn.commit()
+        self.pending = 0
+        self.committed_at = time.monotonic()
+
+
+    def record_file_inventory(self):
+        self.flush()
+        self.logger.info(f"Inventário SQLite salvo em {self.inventory_file}")
+
+
+    def begin_scan(self):
+        self.conn.execute("CREATE TEMP TABLE IF NOT EXISTS seen (path TEXT PRIMARY KEY)")
+        self.conn.execute("DELETE FROM seen")
+        self.scan_stats = {"new": 0, "unchanged": 0, "changed": 0, "removed": 0}
+
+
+    def end_scan(self):
+        if self.scan_stats is None:
+            raise RuntimeError("end_scan chamado sem begin_scan")
+        cursor = self.conn.execute("DELETE FROM files WHERE path NOT IN (SELECT path FROM seen)")
+        self.scan_stats["removed"] += cursor.rowcount
+        self.conn.execute("DELETE FROM seen")
+        self.flush()
+        stats = self.scan_stats
+        self.scan_stats = None
+        return stats
+
+
+    def _mark_seen(self, path_key:str):
+        self._write("INSERT OR IGNORE INTO seen (path) VALUES (?)", (path_key,))
+
+
+    def _new_item(self, path_key:str):
+        self._write("INSERT OR IGNORE INTO files (path) VALUES (?)", (path_key,))
+
+
+    def get_item(self, path:Path):
+        cursor = self.conn.execute(f"SELECT {', '.join(Inventory.FIELDS)} FROM files WHERE path = ?", (self.path_to_key(path),))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        return {field: value for field, value in zip(Inventory.FIELDS, row) if value is not None}
+
+
+    def has_item(self, path):
+        cursor = self.conn.execute("SELECT 1 FROM files WHERE path = ?", (self.path_to_key(path),))
+        return cursor.fetchone() is not None
+
+
+    def get_by_size(self, size:int):
+        return [row[0] for row in self.conn.execute("SELECT path FROM files WHERE size = ?", (size,))]
+
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+
+
+    def clear_hashes(self, path:Path):
+        fields = Inventory.HASH_FIELDS + ["alg"]
+        self._write(f"UPDATE files SET {', '.join(f'{field} = NULL' for field in fields)} WHERE path = ?", (self.path_to_key(path),))
+
+
+    def remove_item(self, path:Path):
+        path_key = self.path_to_key(path)
+        cursor = self._write("DELETE FROM files WHERE path = ?", (path_key,))
+        if cursor.rowcount == 0:
+            self.logger.warning(f"Arquivo {path_key} não está no inventário")
+
+
+    def update_item(self, path:Path, size:int=None, hash_fast:str=None, hash_full:str=None, alg:str=None,
+                    mtime_ns:int=None, ino:int=None, dev:int=None, hash_tail:str=None, hash_mid:str=None):
+        values = {"size": size, "mtime_ns": mtime_ns, "ino": ino, "dev": dev, "hash_fast": hash_fast,
+                  "hash_tail": hash_tail, "hash_mid": hash_mid, "hash_full": hash_full, "alg": alg}
+        values = {field: value for field, value in values.items() if value is not None}
+        if not values:
+            return
+        assignments = ", ".join(f"{field} = ?" for field in values.keys())
+        self._write(f"UPDATE files SET {assignments} WHERE path = ?", (*values.values(), self.path_to_key(path)))
+
+
+    def _groups(self, field:str):
+        """ Retorna (valor, [caminhos]) apenas para os valores compartilhados por mais de um arquivo """
+        cursor = self.conn.execute(
+            f"SELECT {field}, path FROM files WHERE {field} IN "
+            f"(SELECT {field} FROM files WHERE {field} IS NOT NULL GROUP BY {field} HAVING COUNT(*) > 1) "
+            f"ORDER BY {field}")
+        for value, rows in groupby(cursor, key=itemgetter(0)):
+            yield value, [row[1] for row in rows]
+
+
+    def get_by_size_list(self):
+        return self._groups("size")
+
+
+    def get_by_hash_fast_list(self):
+        return self._groups("hash_fast")
+
+
+    def get_by_hash_full_list(self):
+        return self._groups("hash_full")
+
+
     def __str__(self):
-        return json.dumps(self.inventory, indent=4, ensure_ascii=False)
\ No newline at end of file
+        cursor = self.conn.execute(f"SELECT path, {', '.join(Inventory.FIELDS)} FROM files")
+        inventory = {row[0]: {field: value for field, value in zip(Inventory.FIELDS, row[1:]) if value is not None} for row in cursor}
+        return json.dumps(inventory, indent=4, ensure_ascii=False)
\ No newline at end of file
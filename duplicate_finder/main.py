@@ -1,10 +1,11 @@
 import argparse
+import itertools
 import logging
 import json
 
 from pathlib import Path
 from utils import *
-from inventory import Inventory
+from inventory import open_inventory
 
 
 # ==================================================================
@@ -34,38 +35,156 @@ def setup_logging(log_file):
 # ==================================================================
 def print_params(args):
     logger.info(f"********** ARGUMENTOS **********")
-    logger.info(f"Diretório de Destino: \"{args.path}\"")
+    for root in args.roots:
+        logger.info(f"Diretório de Destino: \"{root}\"")
     match (args.op):
         case "dedup":
             logger.info(f"Operação: Detecção de arquivos duplicados na pasta de destino")
         case "inc":
             logger.info(f"Operação: Incorporação de arquivos da entrada na pasta de destino")
     logger.info(f"Deletar arquivos duplicados: {'SIM' if args.delete else 'NÃO'}")
+    if args.link:
+        logger.info(f"Substituir duplicados por links: {args.link}")
+    logger.info(f"Verificar byte a byte: {'SIM' if args.verify else 'NÃO'}")
+    if args.report:
+        logger.info(f"Relatório: {args.report}")
     if args.input_dir:
         logger.info(f"Diretório de Entrada: \"{args.input_dir}\"")
         if args.op == "dedup":
             logger.info("'--op dedup' passado, diretório de  entrada será ignorado")
+        else:
+            logger.info(f"Modo de incorporação: {'MOVER' if args.move else 'COPIAR'}")
     if args.inventory_file:
         logger.info(f"Arquivo de inventário: {args.inventory_file}")
     logger.info(f"Algoritmo de Hash: {args.alg}")
-    # logger.info(f"Extensões de arquivo a ignorar: {args.exclude}")
+    logger.info(f"Etapas de hash: {', '.join(args.stages)}")
+    logger.info(f"Workers: {args.workers} por dispositivo não rotacional ({args.backend}); discos rotacionais são lidos sequencialmente")
+    logger.info(f"Estratégia de leitura: {args.io}{' (descartando cache de páginas)' if args.drop_cache else ''}")
+    if args.exclude:
+        logger.info(f"Padrões a ignorar: {args.exclude}")
+    if args.exclude_ext:
+        logger.info(f"Extensões de arquivo a ignorar: {args.exclude_ext}")
+    logger.info(f"Seguir links simbólicos: {'SIM' if args.follow_symlinks else 'NÃO'}")
+    logger.info(f"Restringir ao mesmo sistema de arquivos: {'SIM' if args.one_file_system else 'NÃO'}")
     # if args.move_dups is not None:
     #     args.delete = False
     #     logger.info(f"Diretório de quarentena: {args.move_dups}")
     logger.info(f"********************************")
 
 
+def run_dedup(args, inventory):
+    """ Detecção de arquivos duplicados na pasta de destino """
+    logger.info("Detecção de arquivos duplicados na pasta de destino")
+    file_list = itertools.chain.from_iterable(
+        scan_files(root, exclude_ext=args.exclude_ext, exclude=args.exclude,
+                   follow_symlinks=args.follow_symlinks, one_file_system=args.one_file_system)
+        for root in args.roots)
+    metrics = {}
+    duplicates = find_duplicates(file_list, args.pre_path or args.roots, alg=args.alg, inventory=inventory, workers=args.workers, backend=args.backend, stages=args.stages,
+                                 io=args.io, drop_cache=args.drop_cache, progress=default_progress(), metrics=metrics)
+    if args.verify:
+        duplicates = verify_duplicates(duplicates, inventory, metrics=metrics)
+    elif (args.delete or args.link) and args.alg in XXHASH_ALGORITHMS:
+        logger.warning(f"{args.alg} não é criptográfico; considere usar --verify antes de deletar")
+    logger.info(f"Duplicatas encontradas: {len(duplicates)} grupos, {sum(reclaimable_bytes(duplicates, inventory).values())} bytes recuperáveis.")
+
+    # O relatório é gravado antes da remoção, enquanto os tamanhos ainda estão no inventário
+    if args.report:
+        write_report(Path(args.report), duplicates, inventory, metrics, roots=[str(r) for r in args.roots], alg=args.alg,
+                     stages=args.stages, verify=args.verify, delete=args.delete, link=args.link)
+
+    # Substitui por links, deleta ou exibe arquivos duplicados
+    if args.link:
+        logger.info(f"***** Substituir duplicados por links ({args.link}) *****")
+        delete_duplicates(duplicates, args.pre_path, inventory, link=args.link)
+        logger.info("***************************************************")
+    elif args.delete:
+        logger.info("***** Deletar arquivos duplicados encontrados *****")
+        delete_duplicates(duplicates, args.pre_path, inventory)
+        logger.info("***************************************************")
+    else:
+        logger.info("***** Lista de arquivos duplicados encontrados *****")
+        for k in duplicates.keys():
+            logger.info(f"Hash '{k}':")
+            for f in duplicates[k]:
+                logger.info(f"Arquivo: {f}")
+        logger.info("****************************************************")
+
+
+def run_inc(args, inventory):
+    """ Incorporação de arquivos da entrada na pasta de destino """
+    logger.info("Incorporação de arquivos da entrada na pasta de destino")
+    if not args.input_dir:
+        logger.error("'--op inc' requer o diretório de entrada (-i/--input-dir)")
+        quit()
+
+    # O destino só é varrido quando não há inventário gravado (ou com --rescan)
+    if args.rescan or len(inventory) == 0:
+        logger.info("Varrendo diretório de destino para montar o inventário")
+        inventory.begin_scan()
+        for path, stat in scan_files(args.roots[0], exclude_ext=args.exclude_ext, exclude=args.exclude,
+                                     follow_symlinks=args.follow_symlinks, one_file_system=args.one_file_system):
+            inventory.add_item(path, stat)
+        stats = inventory.end_scan()
+        logger.info(f"Varredura concluída: {stats['new']} novos, {stats['unchanged']} inalterados, {stats['changed']} alterados, {stats['removed']} removidos.")
+
+    if args.delete and not args.verify and args.alg in XXHASH_ALGORITHMS:
+        logger.warning(f"{args.alg} não é criptográfico; considere usar --verify antes de deletar")
+
+    file_list = scan_files(Path(args.input_dir), exclude_ext=args.exclude_ext, exclude=args.exclude,
+                           follow_symlinks=args.follow_symlinks, one_file_system=args.one_file_system)
+    incorporate_files(file_list, Path(args.input_dir), args.roots[0], inventory, alg=args.alg, stages=args.stages,
+                      move=args.move, delete=args.delete, verify=args.verify, io=args.io, drop_cache=args.drop_cache)
+
+
 def main():
     parser = argparse.ArgumentParser(description="Duplicate File Finder")
 
-    parser.add_argument("path", help="Diretório de destino dos arquivos")
+    parser.add_argument("path", nargs="+", help="Diretório de destino dos arquivos. Com '--op dedup' podem ser informados vários diretórios, inclusive em discos diferentes, que são comparados entre si")
     parser.add_argument("--op", choices=["dedup", "inc"], help="dedup = Apenas busca arquivos duplicados apenas na pasta de destino;inc = incorpora arquivos do diretório de entrada ao diretório de destino, ignorando duplicados")
     parser.add_argument("--delete", action="store_true", help="Deleta arquivos duplicados encontrados. Se não for passado, apenas imprime os duplicados encontrados", default=False)
+    parser.add_argument("--link", choices=LINK_MODES, default=None, help="Substitui cada duplicado por um link para o arquivo mantido em vez de deletá-lo (duplicados que não podem ser vinculados, como reflink sem suporte ou entre discos diferentes, são mantidos)")
     parser.add_argument("-i", "--input-dir", default=None, help="Diretório de entrada dos arquivos (não informar caso queira analisar apenas o diretório de saída)")
-    parser.add_argument("--inventory-file", metavar="ARQUIVO", help="Salva e lê (quando disponível) arquivo contendo inventário")
-    parser.add_argument("-a", "--alg", default="md5", choices=["md5", "sha1", "sha256"])
+    parser.add_argument("--move", action="store_true", default=False, help="Com '--op inc', move os arquivos únicos para o destino em vez de copiá-los")
+    parser.add_argument("--rescan", action="store_true", default=False, help="Com '--op inc', varre o destino mesmo que o inventário já tenha registros")
+    parser.add_argument("--inventory-file", metavar="ARQUIVO", help="Salva e lê (quando disponível) arquivo contendo inventário (CSV, JSON, JSONL ou SQLite, conforme a extensão). Alterações são registradas em um diário durante a execução e recuperadas se ela for interrompida")
+    parser.add_argument("--report", metavar="JSON", default=None, help="Com '--op dedup', grava um relatório JSON com os grupos de duplicados, o espaço recuperável e as métricas de cada etapa")
+    parser.add_argument("--verify", action="store_true", default=False, help="Confirma os duplicados comparando o conteúdo byte a byte antes de listar ou deletar")
+    parser.add_argument("-a", "--alg", default="md5", choices=available_algorithms(), help="Algoritmo de hash. xxh3/xxh128 são não criptográficos e requerem o módulo xxhash. Use benchmark.py para comparar a vazão no seu hardware (padrão: md5)")
+    parser.add_argument("-x", "--exclude", action="append", metavar="GLOB", help="Ignora arquivos e diretórios que correspondam ao padrão (pode ser repetido)")
+    parser.add_argument("--exclude-ext", nargs="*", metavar="EXT", help="Extensões de arquivo a ignorar (ex.: .tmp .part)")
+    parser.add_argument("--follow-symlinks", action="store_true", default=False, help="Segue links simbólicos durante a varredura")
+    parser.add_argument("--one-file-system", action="store_true", default=False, help="Não desce em diretórios montados de outros sistemas de arquivos")
+    parser.add_argument("--stages", default=",".join(DEFAULT_STAGES), help=f"Etapas de hash progressivo separadas por vírgula, dentre {', '.join(HASH_STAGES.keys())}. O hash completo é sempre executado por último (padrão: {','.join(DEFAULT_STAGES)})")
+    parser.add_argument("--io", choices=IO_STRATEGIES, default="auto", help="Estratégia de leitura: read, readinto (buffer reaproveitado), mmap (sem cópia) ou auto (mmap para arquivos grandes) (padrão: auto)")
+    parser.add_argument("--drop-cache", action="store_true", default=False, help="Descarta do cache de páginas os arquivos lidos, preservando o cache das demais aplicações")
+    parser.add_argument("-w", "--workers", type=int, default=1, metavar="N", help="Quantidade de workers para cálculo dos hashes em cada dispositivo não rotacional; cada dispositivo tem sua própria fila (padrão: 1)")
+    parser.add_argument("--backend", choices=["thread", "process"], default="thread", help="thread = pool de threads (indicado quando o gargalo é o disco); process = pool de processos (indicado quando o gargalo é a CPU)")
 
     args = parser.parse_args()
+    if len(args.path) == 1:
+        args.roots = [Path(args.path[0])]
+    else:
+        # Vários diretórios: chaves do inventário passam a ser caminhos absolutos
+        args.roots = [Path(p).absolute() for p in args.path]
+        if args.op == "inc":
+            parser.error("'--op inc' aceita apenas um diretório de destino")
+        for a in args.roots:
+            for b in args.roots:
+                if a != b and a.is_relative_to(b):
+                    parser.error(f"O diretório {a} está contido em {b}")
+    if args.input_dir:
+        # Entrada dentro do destino (ou o contrário) faria cada arquivo de
+        # entrada casar com ele mesmo no inventário, e --delete apagaria a única cópia
+        input_dir, root = Path(args.input_dir).resolve(), args.roots[0].resolve()
+        if input_dir.is_relative_to(root) or root.is_relative_to(input_dir):
+            parser.error(f"O diretório de entrada {args.input_dir} não pode estar contido no destino {args.roots[0]} nem contê-lo")
+    # Com um único diretório as chaves do inventário são relativas a ele
+    args.pre_path = args.roots[0] if len(args.roots) == 1 else None
+    args.stages = [s.strip() for s in args.stages.split(",") if s.strip()]
+    for stage in args.stages:
+        if stage not in HASH_STAGES:
+            parser.error(f"Etapa de hash desconhecida: {stage}")
 
     # Configurar log
     setup_logging("duplicate_finder.log")
@@ -73,47 +192,31 @@ def main():
     # Imprimir parametros
     print_params(args)
 
-    duplicates = None
-
     # Lê arquivo de inventário
     inventory = None
     if args.inventory_file:
         try:
-            inventory = Inventory(Path(args.inventory_file), pre_path=Path(args.path))
+            inventory = open_inventory(Path(args.inventory_file), pre_path=args.pre_path)
         except ValueError as e:
             logger.error(e)
             quit()
     else:
-        inventory = Inventory(pre_path=Path(args.path))
+        inventory = open_inventory(pre_path=args.pre_path)
     
     # Performa operação
-    if args.op == "dedup":
-            logger.info("Detecção de arquivos duplicados na pasta de destino")
-            file_list = scan_files(Path(args.path))
-            duplicates = find_duplicates(file_list, Path(args.path), alg=args.alg, inventory=inventory)
-            logger.info(f"Duplicatas encontradas: {len(duplicates)} grupos.")
-
-            # Deleta (ou exibe) arquivos duplicados
-            if args.delete:
-                logger.info("***** Deletar arquivos duplicados encontrados *****")
-                delete_duplicates(duplicates, Path(args.path), inventory)
-                logger.info("***************************************************")
-            else:
-                logger.info("***** Lista de arquivos duplicados encontrados *****")
-                for k in duplicates.keys():
-                    logger.info(f"Hash '{k}':")
-                    for f in duplicates[k]:
-                        logger.info(f"Arquivo: {f}")
-                logger.info("****************************************************")
-
-    elif args.op == "inc":
-            logger.info("Incorporação de arquivos da entrada na pasta de destino")
+    try:
+        if args.op == "dedup":
+            run_dedup(args, inventory)
+        elif args.op == "inc":
+            run_inc(args, inventory)
+    except KeyboardInterrupt:
+        logger.warning("Execução interrompida; o inventário parcial será gravado e reaproveitado na próxima execução")
 
     # Grava arquivo de inventário atualizado
     if args.inventory_file:
         try:
             inventory.record_file_inventory()
-        except e:
+        except Exception as e:
             logger.error(f"Não foi possível gravar o arquivo de inventário: {e}")
 
 
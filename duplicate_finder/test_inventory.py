@@ -0,0 +1,158 @@
+import json
+import os
+from pathlib import Path
+
+import pytest
+
+import inventory as inventory_module
+from inventory import Inventory
+
+
+HASHES = {
+    "a.txt": {"hash_fast": "aaa1", "hash_full": "aaa2", "alg": "md5"},
+    "b.txt": {"hash_fast": "aaa1", "hash_tail": "bbb1", "hash_mid": "bbb2", "hash_full": "aaa2", "alg": "md5"},
+    "sub/c.txt": {},
+}
+
+
+def make_tree(root:Path):
+    """ Cria os arquivos de HASHES em root, a e b com o mesmo tamanho """
+    for name, content in (("a.txt", b"x" * 10), ("b.txt", b"y" * 10), ("sub/c.txt", b"z" * 3)):
+        path = root / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(content)
+
+
+def populate(inv:Inventory, root:Path):
+    for name, hashes in HASHES.items():
+        inv.add_item(root / name)
+        if hashes:
+            inv.update_item(root / name, **hashes)
+
+
+def snapshot(inv:Inventory, root:Path):
+    return {name: inv.get_item(root / name).to_dict() for name in HASHES}
+
+
+@pytest.fixture
+def tree(tmp_path):
+    root = tmp_path / "tree"
+    make_tree(root)
+    return root
+
+
+@pytest.mark.parametrize("suffix", [".csv", ".json", ".jsonl"])
+def test_round_trip(tmp_path, tree, suffix):
+    """ Gravar e reler o inventário preserva registros e índices, inclusive campos vazios no CSV """
+    inventory_file = tmp_path / f"inventory{suffix}"
+    inv = Inventory(inventory_file, pre_path=tree)
+    populate(inv, tree)
+    expected = snapshot(inv, tree)
+    inv.record_file_inventory()
+    inv.journal.close()
+
+    loaded = Inventory(inventory_file, pre_path=tree)
+    assert snapshot(loaded, tree) == expected
+    assert loaded.get_item(tree / "a.txt")["size"] == 10
+    assert isinstance(loaded.get_item(tree / "a.txt")["mtime_ns"], int)
+    assert "hash_full" not in loaded.get_item(tree / "sub/c.txt")
+    assert sorted(loaded.get_by_size(10)) == ["a.txt", "b.txt"]
+    assert dict(loaded.get_by_hash_full_list())["aaa2"] == {"a.txt", "b.txt"}
+    loaded.journal.close()
+
+
+def test_csv_header_and_empty_columns(tmp_path, tree):
+    inventory_file = tmp_path / "inventory.csv"
+    inv = Inventory(inventory_file, pre_path=tree)
+    populate(inv, tree)
+    inv.record_file_inventory()
+    inv.journal.close()
+
+    lines = inventory_file.read_text(encoding="utf-8").splitlines()
+    assert lines[0].split(",") == ["path"] + Inventory.FIELDS
+    row = next(line for line in lines if line.startswith("sub"))
+    # Campos sem valor ficam como colunas vazias, não como "None"
+    assert "None" not in row
+    assert row.split(",")[Inventory.FIELDS.index("alg") + 1] == ""
+
+
+def test_journal_replay_ignores_torn_last_line(tmp_path, tree, caplog):
+    """ Alterações de uma execução interrompida são recuperadas do diário, até a última linha completa """
+    inventory_file = tmp_path / "inventory.json"
+    inv = Inventory(inventory_file, pre_path=tree)
+    populate(inv, tree)
+    inv.flush()
+    inv.journal.close()
+    # Execução interrompida no meio da escrita de um registro
+    journal_file = inv.journal_file()
+    with open(journal_file, "a", encoding="utf-8") as f:
+        f.write('{"path": "d.txt", "item": {"si')
+    assert not inventory_file.exists()
+
+    recovered = Inventory(inventory_file, pre_path=tree)
+    assert snapshot(recovered, tree) == snapshot(inv, tree)
+    assert not recovered.has_item(tree / "d.txt")
+    assert "Registro incompleto" in caplog.text
+    # O diário recuperado é consolidado no arquivo principal e esvaziado
+    assert set(json.loads(inventory_file.read_text(encoding="utf-8"))) == set(HASHES)
+    assert journal_file.stat().st_size == 0
+    recovered.journal.close()
+
+
+def test_journal_replay_applies_removals(tmp_path, tree):
+    inventory_file = tmp_path / "inventory.jsonl"
+    inv = Inventory(inventory_file, pre_path=tree)
+    populate(inv, tree)
+    inv.record_file_inventory()
+    inv.remove_item(tree / "b.txt")
+    inv.flush()
+    inv.journal.close()
+
+    recovered = Inventory(inventory_file, pre_path=tree)
+    assert not recovered.has_item(tree / "b.txt")
+    assert recovered.get_by_size(10) == ["a.txt"]
+    recovered.journal.close()
+
+
+def test_record_writes_temp_file_then_replaces(tmp_path, tree, monkeypatch):
+    inventory_file = tmp_path / "inventory.json"
+    inv = Inventory(inventory_file, pre_path=tree)
+    populate(inv, tree)
+
+    replaced = []
+    real_replace = os.replace
+    def spy_replace(src, dst):
+        # No momento da troca o temporário já está completo
+        assert json.loads(Path(src).read_text(encoding="utf-8")).keys() == set(HASHES)
+        replaced.append((Path(src), Path(dst)))
+        real_replace(src, dst)
+    monkeypatch.setattr(inventory_module.os, "replace", spy_replace)
+
+    inv.record_file_inventory()
+    assert replaced == [(tmp_path / ".inventory.json.tmp", inventory_file)]
+    assert not (tmp_path / ".inventory.json.tmp").exists()
+    inv.journal.close()
+
+
+def test_interrupted_record_keeps_previous_file(tmp_path, tree, monkeypatch):
+    """ Uma falha antes do os.replace preserva o inventário gravado anteriormente """
+    inventory_file = tmp_path / "inventory.jsonl"
+    inv = Inventory(inventory_file, pre_path=tree)
+    populate(inv, tree)
+    inv.record_file_inventory()
+    previous = inventory_file.read_bytes()
+
+    inv.remove_item(tree / "a.txt")
+    def failing_replace(src, dst):
+        raise OSError("disco cheio")
+    monkeypatch.setattr(inventory_module.os, "replace", failing_replace)
+    with pytest.raises(OSError):
+        inv.record_file_inventory()
+
+    assert inventory_file.read_bytes() == previous
+    # A remoção continua no diário e é recuperada na próxima execução
+    monkeypatch.undo()
+    inv.journal.close()
+    recovered = Inventory(inventory_file, pre_path=tree)
+    assert not recovered.has_item(tree / "a.txt")
+    recovered.journal.close()
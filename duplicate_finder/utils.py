@@ -1,9 +1,16 @@
-import csv
+import errno
+import fnmatch
+import functools
 import hashlib
 import json
 import logging
+import mmap
 import os
+import shutil
+import tempfile
+import time
 from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
 from inventory import Inventory
 from pathlib import Path
 try:
@@ -11,105 +18,1042 @@ try:
     USE_TQDM = True
 except ImportError:
     USE_TQDM = False
+try:
+    import fcntl
+    USE_FCNTL = True
+except ImportError:
+    USE_FCNTL = False
+try:
+    import xxhash
+    USE_XXHASH = True
+except ImportError:
+    USE_XXHASH = False
 
 
 logger=logging.getLogger("duplicate_finder")
 logger.setLevel(logging.DEBUG)
 
 
-def compute_hash(path, alg="md5", fast = False, chunk_size=1024*1024):
+# Etapas de hash progressivo: cada etapa lê mais dados que a anterior e só é
+# aplicada aos arquivos que continuam empatados. "full" é sempre a última.
+HEAD_SIZE = 4096
+TAIL_SIZE = 64 * 1024
+MIDDLE_SAMPLES = 8
+MIDDLE_SAMPLE_SIZE = 256 * 1024
+HASH_STAGES = {"head": "hash_fast", "tail": "hash_tail", "middle": "hash_mid", "full": "hash_full"}
+DEFAULT_STAGES = ["head", "tail", "middle", "full"]
+
+
+# Algoritmos criptográficos da hashlib; blake2b/blake2s são os mais rápidos
+# entre eles. xxh3/xxh128 (não criptográficos) exigem o módulo xxhash.
+HASHLIB_ALGORITHMS = ["md5", "sha1", "sha256", "blake2b", "blake2s"]
+XXHASH_ALGORITHMS = ["xxh3", "xxh128"]
+
+
+def available_algorithms():
+    """ Retorna os algoritmos de hash disponíveis no ambiente """
+    return HASHLIB_ALGORITHMS + (XXHASH_ALGORITHMS if USE_XXHASH else [])
+
+
+def new_hasher(alg):
+    """
+    Cria o objeto de hash para o algoritmo informado.
+
+    Args:
+        alg (str): Algoritmo de hash (ver available_algorithms)
+
+    Returns:
+        Objeto com os métodos update() e hexdigest()
+    """
+    if alg in XXHASH_ALGORITHMS:
+        if not USE_XXHASH:
+            raise ValueError(f"O algoritmo {alg} requer o módulo xxhash")
+        return xxhash.xxh3_64() if alg == "xxh3" else xxhash.xxh3_128()
+    return hashlib.new(alg)
+
+
+def stage_ranges(stage, size):
+    """
+    Retorna os trechos do arquivo lidos em uma etapa de hash.
+
+    Args:
+        stage (str): Etapa (head, tail, middle, full)
+        size (int): Tamanho do arquivo
+
+    Returns:
+        [(int, int)]: Lista de (offset, tamanho); None para o arquivo completo
+    """
+    match stage:
+        case "head":
+            return [(0, HEAD_SIZE)]
+        case "tail":
+            return [(max(0, size - TAIL_SIZE), TAIL_SIZE)]
+        case "middle":
+            step = size // (MIDDLE_SAMPLES + 1)
+            return [(max(0, step * (i + 1) - MIDDLE_SAMPLE_SIZE // 2), MIDDLE_SAMPLE_SIZE) for i in range(MIDDLE_SAMPLES)]
+        case "full":
+            return None
+    raise ValueError(f"Etapa de hash desconhecida: {stage}")
+
+
+def stage_bytes(stage, size):
+    """ Quantidade de bytes lidos por uma etapa de hash em um arquivo de tamanho 'size' """
+    ranges = stage_ranges(stage, size)
+    if ranges is None:
+        return size
+    return sum(max(0, min(length, size - offset)) for offset, length in ranges)
+
+
+# Estratégias de leitura para compute_hash:
+#   read     = f.read() em blocos, aloca um novo objeto bytes a cada bloco
+#   readinto = f.readinto() reaproveitando o mesmo buffer
+#   mmap     = mapeia o arquivo em memória e passa fatias sem cópia ao hash
+#   auto     = mmap para arquivos a partir de MMAP_THRESHOLD, readinto para os demais
+IO_STRATEGIES = ["auto", "read", "readinto", "mmap"]
+MMAP_THRESHOLD = 64 * 1024 * 1024
+
+
+def adaptive_chunk_size(size):
+    """ Tamanho de bloco proporcional ao arquivo: menos chamadas de sistema em arquivos grandes, pouca memória nos pequenos """
+    if size < 1024 * 1024:
+        return 64 * 1024
+    if size < 64 * 1024 * 1024:
+        return 1024 * 1024
+    return 8 * 1024 * 1024
+
+
+def _fadvise(fd, advice):
+    """ posix_fadvise quando disponível na plataforma; é apenas uma dica, erros são ignorados """
+    if advice is None or not hasattr(os, "posix_fadvise"):
+        return
+    try:
+        os.posix_fadvise(fd, 0, 0, advice)
+    except OSError:
+        pass
+
+
+def _hash_read(hash, f, ranges, chunk_size):
+    for offset, length in ranges:
+        f.seek(offset)
+        remaining = length
+        while remaining > 0:
+            data = f.read(min(chunk_size, remaining))
+            if not data:
+                break
+            hash.update(data)
+            remaining -= len(data)
+
+
+def _hash_readinto(hash, f, ranges, chunk_size):
+    buffer = memoryview(bytearray(min(chunk_size, max(length for _, length in ranges) or 1)))
+    for offset, length in ranges:
+        f.seek(offset)
+        remaining = length
+        while remaining > 0:
+            n = f.readinto(buffer[:min(len(buffer), remaining)])
+            if not n:
+                break
+            hash.update(buffer[:n])
+            remaining -= n
+
+
+def _hash_mmap(hash, f, ranges, chunk_size):
+    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        if hasattr(mm, "madvise") and hasattr(mmap, "MADV_SEQUENTIAL"):
+            mm.madvise(mmap.MADV_SEQUENTIAL)
+        with memoryview(mm) as view:
+            for offset, length in ranges:
+                end = min(offset + length, len(mm))
+                for pos in range(offset, end, chunk_size):
+                    hash.update(view[pos:min(pos + chunk_size, end)])
+
+
+def compute_hash(path, alg="md5", fast = False, chunk_size=None, ranges=None, io="auto", drop_cache=False):
     """
     Calcula o hash do arquivo.
 
     Args:
         path (str): Caminho do arquivo
-        alg="md5" (str): Algoritmo de hash (md5, sha1, sha256)
+        alg="md5" (str): Algoritmo de hash (ver available_algorithms)
         fast=True (bool): Lê apenas os primeiros 4KB de dados
-        chunk_size=1024*1024 (int): Tamanho dos blocos ao calcular o hash
+        chunk_size=None (int): Tamanho dos blocos ao calcular o hash; se omitido, é definido pelo tamanho do arquivo
+        ranges=None ([(int, int)]): Lê apenas os trechos (offset, tamanho) informados
+        io="auto" (str): Estratégia de leitura (ver IO_STRATEGIES)
+        drop_cache=False (bool): Descarta as páginas lidas do cache do sistema ao final (POSIX_FADV_DONTNEED)
 
     Returns:
         str: O hash do arquivo informado
     """
-    hash = hashlib.new(alg)
+    hash = new_hasher(alg)
+    if fast:
+        ranges = [(0, HEAD_SIZE)]
+
+    with open(path, "rb", buffering=0) as f:
+        fd = f.fileno()
+        size = os.fstat(fd).st_size
+        if chunk_size is None:
+            chunk_size = adaptive_chunk_size(size)
+        if ranges is None:
+            ranges = [(0, size)]
+            _fadvise(fd, getattr(os, "POSIX_FADV_SEQUENTIAL", None))
+        if io == "auto":
+            io = "mmap" if len(ranges) == 1 and ranges[0][1] >= MMAP_THRESHOLD else "readinto"
+        # Arquivos vazios não podem ser mapeados
+        if io == "mmap" and size == 0:
+            io = "readinto"
 
-    with open(path, "rb") as f:
-        if fast:
-            hash.update(f.read(4096))
-        else:
-            for chunk in iter(lambda: f.read(chunk_size), b""):
-                hash.update(chunk)
+        try:
+            match io:
+                case "read":
+                    _hash_read(hash, f, ranges, chunk_size)
+                case "readinto":
+                    _hash_readinto(hash, f, ranges, chunk_size)
+                case "mmap":
+                    _hash_mmap(hash, f, ranges, chunk_size)
+                case _:
+                    raise ValueError(f"Estratégia de leitura desconhecida: {io}")
+        finally:
+            if drop_cache:
+                _fadvise(fd, getattr(os, "POSIX_FADV_DONTNEED", None))
     
     return hash.hexdigest()
 
 
-def scan_files(path:Path, exclude_ext=None):
+def scan_files(path:Path, exclude_ext=None, exclude=None, follow_symlinks=False, one_file_system=False):
     """
-    Varre diretório e retorna lista de arquivos
+    Varre o diretório sob demanda, devolvendo cada arquivo assim que é encontrado.
+
+    Usa os.scandir e reaproveita o stat já obtido pelo DirEntry, de modo que a
+    memória usada não depende da quantidade de arquivos e o agrupamento por
+    tamanho no inventário começa enquanto a varredura ainda está em andamento.
 
     Args:
-        path (str): Caminho do diretório
+        path (Path): Caminho do diretório
         exclude_ext=None ([]): Lista de extensões dos tipos de arquivo a ignorar
+        exclude=None ([]): Padrões glob a ignorar, comparados com o nome e com o caminho relativo
+        follow_symlinks=False (bool): Segue links simbólicos para arquivos e diretórios
+        one_file_system=False (bool): Não desce em diretórios de outros pontos de montagem
+
+    Yields:
+        (Path, os.stat_result): Arquivo encontrado e seu stat
+    """
+    exclude_ext = [e.lower() for e in exclude_ext] if exclude_ext else []
+    exclude = exclude or []
+    root_stat = os.stat(path)
+    root_dev = root_stat.st_dev
+    visited = {(root_stat.st_dev, root_stat.st_ino)}
+    stack = [str(path)]
+
+    def excluded(entry):
+        if not exclude:
+            return False
+        rel_path = os.path.relpath(entry.path, path)
+        return any(fnmatch.fnmatch(entry.name, p) or fnmatch.fnmatch(rel_path, p) for p in exclude)
+
+    while stack:
+        current = stack.pop()
+        try:
+            with os.scandir(current) as it:
+                entries = list(it)
+        except OSError as e:
+            logger.warning(f"Diretório inacessível: {current} - {e}")
+            continue
+
+        for entry in entries:
+            try:
+                if excluded(entry):
+                    continue
+                if entry.is_dir(follow_symlinks=follow_symlinks):
+                    stat = entry.stat(follow_symlinks=follow_symlinks)
+                    if one_file_system and stat.st_dev != root_dev:
+                        continue
+                    # Evita laços ao seguir links simbólicos para diretórios
+                    if follow_symlinks:
+                        if (stat.st_dev, stat.st_ino) in visited:
+                            continue
+                        visited.add((stat.st_dev, stat.st_ino))
+                    stack.append(entry.path)
+                elif entry.is_file(follow_symlinks=follow_symlinks):
+                    if exclude_ext and os.path.splitext(entry.name)[1].lower() in exclude_ext:
+                        continue
+                    yield Path(entry.path), entry.stat(follow_symlinks=follow_symlinks)
+            except OSError as e:
+                logger.warning(f"Arquivo inacessível: {entry.path} - {e}")
+
+
+def _hash_job(path, alg, stage, io, drop_cache):
+    """ Executa compute_hash em um worker, devolvendo a exceção em vez de propagá-la """
+    try:
+        ranges = stage_ranges(stage, os.path.getsize(path))
+        return path, compute_hash(path, alg=alg, ranges=ranges, io=io, drop_cache=drop_cache), None
+    except OSError as e:
+        return path, None, e
+
+
+@functools.lru_cache(maxsize=None)
+def is_rotational(dev):
+    """
+    Indica se o dispositivo é um disco rotacional, consultando /sys/dev/block.
+
+    Dispositivos sem informação (rede, overlay, outras plataformas) são
+    tratados como não rotacionais.
+    """
+    try:
+        block = os.path.realpath(f"/sys/dev/block/{os.major(dev)}:{os.minor(dev)}")
+    except (AttributeError, ValueError):
+        return False
+    # Partições não têm "queue"; a informação fica no disco pai
+    for queue in (os.path.join(block, "queue"), os.path.join(os.path.dirname(block), "queue")):
+        try:
+            with open(os.path.join(queue, "rotational"), "r") as f:
+                return f.read().strip() == "1"
+        except OSError:
+            continue
+    return False
+
+
+def device_workers(dev, workers):
+    """ Concorrência de leitura para o dispositivo: discos rotacionais são lidos um arquivo por vez """
+    return 1 if is_rotational(dev) else max(1, workers)
+
+
+def hash_files(paths, alg="md5", stage="full", workers=1, backend="thread", io="auto", drop_cache=False):
+    """
+    Calcula o hash de uma lista de arquivos, opcionalmente em paralelo.
+
+    Os arquivos são separados em uma fila por dispositivo (st_dev), cada uma com
+    seu próprio pool: discos rotacionais são lidos sequencialmente, em ordem de
+    inode, para evitar deslocamentos da cabeça de leitura, enquanto os demais
+    dispositivos recebem 'workers' leituras simultâneas. Os resultados são
+    devolvidos à thread chamadora conforme ficam prontos, de modo que
+    atualizações no inventário acontecem sempre em uma única thread.
+
+    Args:
+        paths ([Path]): Arquivos a processar
+        alg="md5" (str): Algoritmo de hash
+        stage="full" (str): Etapa de hash (head, tail, middle, full)
+        workers=1 (int): Quantidade de workers por dispositivo não rotacional; 1 com um único dispositivo processa na thread atual
+        backend="thread" (str): "thread" (ThreadPoolExecutor) ou "process" (ProcessPoolExecutor)
+        io="auto" (str): Estratégia de leitura (ver IO_STRATEGIES)
+        drop_cache=False (bool): Descarta as páginas lidas do cache do sistema
+
+    Yields:
+        (Path, str, Exception): Arquivo, hash calculado (None em caso de erro) e erro ocorrido
+    """
+    if backend not in ["thread", "process"]:
+        raise ValueError(f"Backend de hash desconhecido: {backend}")
+
+    queues = defaultdict(list)
+    for p in paths:
+        try:
+            stat = os.stat(p)
+        except OSError as e:
+            yield p, None, e
+            continue
+        queues[stat.st_dev].append((stat.st_ino, p))
+
+    if len(queues) == 1 and device_workers(next(iter(queues)), workers) <= 1:
+        for _, p in sorted(next(iter(queues.values()))):
+            yield _hash_job(p, alg, stage, io, drop_cache)
+        return
+
+    executors = {}
+    iterators = {}
+    windows = {}
+    for dev, queue in queues.items():
+        n = device_workers(dev, workers)
+        if n == 1:
+            queue.sort()
+        executor_class = ProcessPoolExecutor if backend == "process" else ThreadPoolExecutor
+        executors[dev] = executor_class(max_workers=n)
+        iterators[dev] = iter(p for _, p in queue)
+        # Mantém uma janela limitada de tarefas pendentes por dispositivo para
+        # não acumular milhões de futures na memória em varreduras grandes
+        windows[dev] = n * 4
+
+    pending = {}
+    in_flight = defaultdict(int)
+
+    def refill(dev):
+        while in_flight[dev] < windows[dev]:
+            p = next(iterators[dev], None)
+            if p is None:
+                return
+            pending[executors[dev].submit(_hash_job, p, alg, stage, io, drop_cache)] = dev
+            in_flight[dev] += 1
+
+    try:
+        for dev in queues.keys():
+            refill(dev)
+        while pending:
+            done, _ = wait(pending.keys(), return_when=FIRST_COMPLETED)
+            for future in done:
+                dev = pending.pop(future)
+                in_flight[dev] -= 1
+                yield future.result()
+                refill(dev)
+    finally:
+        for executor in executors.values():
+            executor.shutdown(cancel_futures=True)
+
+
+# ==================================================================
+# Progresso
+# ==================================================================
+# Callbacks de progresso recebem (etapa, concluídos, total). São chamados com
+# concluídos=0 no início da etapa e concluídos=total ao final.
+PROGRESS_LOG_INTERVAL = 10.0
+
+
+def tqdm_progress():
+    """ Callback de progresso que exibe uma barra tqdm por etapa """
+    bars = {}
+
+    def progress(stage, done, total):
+        if stage not in bars:
+            bars[stage] = tqdm(desc=f"Hash ({stage})", total=total)
+        bars[stage].update(done - bars[stage].n)
+        if done >= total:
+            bars.pop(stage).close()
+    return progress
+
+
+def log_progress(interval=PROGRESS_LOG_INTERVAL):
+    """ Callback de progresso que registra no log a cada 'interval' segundos """
+    last = {}
+
+    def progress(stage, done, total):
+        now = time.monotonic()
+        if done == 0:
+            last[stage] = now
+        elif done >= total or now - last.get(stage, 0) >= interval:
+            last[stage] = now
+            logger.info(f"Hash ({stage}): {done}/{total} arquivos ({done * 100 // max(total, 1)}%)")
+    return progress
+
+
+def default_progress():
+    """ Barra tqdm quando disponível; caso contrário, progresso periódico no log """
+    return tqdm_progress() if USE_TQDM else log_progress()
+
+
+def _run_stage(groups, stage, alg, inventory:Inventory, workers, backend, io, drop_cache, progress=None):
+    """
+    Executa uma etapa de hash sobre os grupos candidatos e os subdivide pelo hash obtido.
+
+    Hashes já gravados no inventário com o mesmo algoritmo são reaproveitados.
+    Registros calculados com outro algoritmo têm seus hashes descartados antes
+    do recálculo, para que um mesmo registro nunca misture algoritmos.
+
+    Etapas parciais que leriam o arquivo inteiro são puladas para o grupo,
+    que segue direto para o hash completo.
 
     Returns:
-        []: Lista de arquivos encontrados
+        ([[str]], dict): Novos grupos (com mais de um elemento) e estatísticas da etapa
     """
-    files = []
+    field = HASH_STAGES[stage]
+    stats = {"stage": stage, "candidates_in": sum(len(g) for g in groups), "files": 0, "bytes_read": 0, "cached": 0,
+             "rehashed": 0, "errors": 0, "discarded": 0, "bytes_saved": 0}
+    wall, cpu = time.perf_counter(), time.process_time()
 
-    for p in path.rglob("*"):
-        if p.is_file():
-            if exclude_ext and p.suffix.lower() in exclude_ext:
+    paths = []
+    for flist in groups:
+        size = inventory.get_item(inventory.key_to_path(flist[0]))["size"]
+        if stage != "full" and stage_bytes(stage, size) >= size:
+            continue
+        for f in flist:
+            # Arquivos inalterados desde a última varredura mantêm o hash gravado
+            item = inventory.get_item(inventory.key_to_path(f))
+            if item.get(field) and item.get("alg") == alg:
+                stats["cached"] += 1
                 continue
-            files.append(p)
+            if item.get("alg") and item.get("alg") != alg:
+                inventory.clear_hashes(inventory.key_to_path(f))
+                stats["rehashed"] += 1
+            paths.append(inventory.key_to_path(f))
+            stats["files"] += 1
+            stats["bytes_read"] += stage_bytes(stage, size)
+
+    if progress is not None:
+        progress(stage, 0, len(paths))
+    for done, (path, h, error) in enumerate(hash_files(paths, alg=alg, stage=stage, workers=workers, backend=backend,
+                                                       io=io, drop_cache=drop_cache), start=1):
+        if progress is not None:
+            progress(stage, done, len(paths))
+        if error is not None:
+            logger.warning(f"Arquivo inacessível: {path} - {error}")
+            stats["errors"] += 1
+            continue
+        inventory.update_item(path, alg=alg, **{field: h})
 
-    return files
+    new_groups = []
+    for flist in groups:
+        size = inventory.get_item(inventory.key_to_path(flist[0]))["size"]
+        if stage != "full" and stage_bytes(stage, size) >= size:
+            new_groups.append(flist)
+            continue
+        by_hash = defaultdict(list)
+        for f in flist:
+            item = inventory.get_item(inventory.key_to_path(f))
+            if item.get(field) and item.get("alg") == alg:
+                by_hash[item[field]].append(f)
+        for subgroup in by_hash.values():
+            if len(subgroup) > 1:
+                new_groups.append(subgroup)
+            else:
+                # Arquivo descartado nesta etapa: o hash completo não precisará lê-lo
+                stats["discarded"] += 1
+                if stage != "full":
+                    stats["bytes_saved"] += size - stage_bytes(stage, size)
 
+    # O tempo de CPU abrange as threads deste processo; com backend "process" o
+    # trabalho dos processos filhos não é contabilizado
+    stats["candidates_out"] = sum(len(g) for g in new_groups)
+    stats["wall_seconds"] = time.perf_counter() - wall
+    stats["cpu_seconds"] = time.process_time() - cpu
+    return new_groups, stats
 
-def find_duplicates(files, output_dir:Path, alg="md5", inventory:Inventory=None):
+
+def _distinct_files(inventory:Inventory, flist):
+    """ Quantidade de arquivos físicos distintos (dev, inode); registros sem inode gravado são considerados distintos """
+    inodes = set()
+    for f in flist:
+        item = inventory.get_item(inventory.key_to_path(f))
+        inodes.add((item["dev"], item["ino"]) if "ino" in item.keys() and "dev" in item.keys() else f)
+    return len(inodes)
+
+
+def find_duplicates(files, output_dir, alg="md5", inventory:Inventory=None, workers=1, backend="thread", stages=None,
+                    io="auto", drop_cache=False, progress=None, metrics:dict=None):
+    """
+    Busca arquivos duplicados, refinando os grupos de mesmo tamanho por etapas
+    progressivas de hash até o hash completo.
+
+    Args:
+        files: Iterável de (Path, os.stat_result), como devolvido por scan_files
+        output_dir (Path): Diretório de destino, ou lista de diretórios varridos em conjunto
+        alg="md5" (str): Algoritmo de hash
+        inventory=None (Inventory): Inventário a usar e atualizar
+        workers=1 (int): Quantidade de workers para cálculo dos hashes
+        backend="thread" (str): Backend de paralelismo (thread, process)
+        stages=None ([str]): Etapas de hash a executar (padrão: DEFAULT_STAGES)
+        io="auto" (str): Estratégia de leitura (ver IO_STRATEGIES)
+        drop_cache=False (bool): Descarta as páginas lidas do cache do sistema
+        progress=None (callable): Callback de progresso (ver default_progress)
+        metrics=None (dict): Se informado, recebe as estatísticas da varredura ("scan") e de cada etapa ("stages")
+
+    Returns:
+        dict: Hash completo -> lista de caminhos duplicados
+    """
     logger.info("Iniciando busca por arquivos duplicados..")
+    if metrics is None:
+        metrics = {}
 
-    for f in files:
-        if inventory:
-            inventory.add_item(f)
-    
-    iterable = inventory.get_by_size_list()
-    if USE_TQDM:
-        iterable = tqdm(iterable, desc="Hash parcial (4096 bytes)")
-        for size, flist in iterable:
-            if len(flist) < 2:
-                continue
-            for f in flist:
-                path = output_dir / Path(f)
+    if inventory is None:
+        # Com vários diretórios as chaves são caminhos absolutos, que identificam a raiz de cada arquivo
+        inventory = Inventory(pre_path=output_dir if isinstance(output_dir, Path) else None)
+    stages = [s for s in (stages or DEFAULT_STAGES) if s != "full"] + ["full"]
+
+    wall, cpu = time.perf_counter(), time.process_time()
+    inventory.begin_scan()
+    for path, stat in files:
+        inventory.add_item(path, stat)
+    stats = inventory.end_scan()
+    logger.info(f"Varredura concluída: {stats['new']} novos, {stats['unchanged']} inalterados, {stats['changed']} alterados, {stats['removed']} removidos.")
+
+    # Os grupos são copiados antes do processamento, já que update_item altera os índices
+    groups = [list(flist) for _, flist in inventory.get_by_size_list() if len(flist) > 1]
+    # Links físicos de um mesmo arquivo não ocupam espaço extra e não são duplicados entre si
+    groups = [flist for flist in groups if _distinct_files(inventory, flist) > 1]
+    logger.info(f"Grupos de mesmo tamanho: {len(groups)} ({sum(len(g) for g in groups)} arquivos)")
+    metrics["scan"] = {**stats, "files": len(inventory), "size_groups": len(groups),
+                       "candidates_out": sum(len(g) for g in groups),
+                       "wall_seconds": time.perf_counter() - wall, "cpu_seconds": time.process_time() - cpu}
+
+    metrics["stages"] = []
+    for stage in stages:
+        groups, stats = _run_stage(groups, stage, alg, inventory, workers, backend, io, drop_cache, progress)
+        metrics["stages"].append(stats)
+        logger.info(f"Etapa '{stage}': {stats['files']} arquivos lidos ({stats['bytes_read']} bytes), "
+                    f"{stats['cached']} do inventário, {stats['rehashed']} recalculados por troca de algoritmo, "
+                    f"{stats['discarded']} descartados, "
+                    f"{stats['bytes_saved']} bytes de hash completo evitados "
+                    f"({stats['wall_seconds']:.2f}s, {stats['cpu_seconds']:.2f}s de CPU).")
+    inventory.flush()
+
+    duplicates = {}
+    for flist in groups:
+        if _distinct_files(inventory, flist) < 2:
+            continue
+        h = inventory.get_item(inventory.key_to_path(flist[0]))["hash_full"]
+        duplicates[h] = sorted(flist)
+    return duplicates
+
+
+# Quantidade máxima de arquivos abertos simultaneamente na verificação
+VERIFY_MAX_OPEN = 256
+
+
+def _verify_group(paths, chunk_size):
+    """
+    Compara byte a byte um grupo de arquivos, lendo todos em paralelo bloco a bloco.
+
+    Os arquivos são separados em subgrupos assim que divergem, e subgrupos com
+    um único arquivo deixam de ser lidos. Cada arquivo é lido uma única vez.
+
+    Returns:
+        ([[int]], int): Subgrupos (índices em paths) com mais de um elemento e bytes lidos
+    """
+    bytes_read = 0
+    files = []
+    try:
+        for p in paths:
+            files.append(open(p, "rb"))
+
+        groups = [list(range(len(files)))]
+        finished = []
+        while groups:
+            next_groups = []
+            for group in groups:
+                # Particiona o grupo pelo conteúdo do bloco atual, comparando com o representante de cada partição
+                partitions = []
+                for i in group:
+                    chunk = files[i].read(chunk_size)
+                    bytes_read += len(chunk)
+                    for reference, members in partitions:
+                        if reference == chunk:
+                            members.append(i)
+                            break
+                    else:
+                        partitions.append((chunk, [i]))
+                for chunk, members in partitions:
+                    if len(members) < 2:
+                        files[members[0]].close()
+                    elif chunk:
+                        next_groups.append(members)
+                    else:
+                        # Fim de arquivo alcançado juntos: conteúdo idêntico
+                        finished.append(members)
+            groups = next_groups
+        return finished, bytes_read
+    finally:
+        for f in files:
+            f.close()
+
+
+def verify_duplicates(duplicates, inventory:Inventory, chunk_size=1024*1024, metrics:dict=None):
+    """
+    Confirma os grupos de duplicados comparando o conteúdo byte a byte.
+
+    Útil antes de deletar arquivos, sobretudo com algoritmos não criptográficos.
+    Grupos maiores que VERIFY_MAX_OPEN são verificados em lotes contra o
+    primeiro arquivo do grupo, que é relido a cada lote.
+
+    Args:
+        duplicates (dict): Hash -> lista de caminhos, como devolvido por find_duplicates
+        inventory (Inventory): Inventário usado para resolver os caminhos
+        chunk_size=1024*1024 (int): Tamanho dos blocos comparados
+        metrics=None (dict): Se informado, recebe as estatísticas da verificação ("verify")
+
+    Returns:
+        dict: Grupos confirmados. Grupos que divergiram recebem o sufixo "#n" no hash
+    """
+    logger.info("Verificando duplicados byte a byte..")
+    wall, cpu = time.perf_counter(), time.process_time()
+    verified = {}
+    total_read = 0
+    split = 0
+    for h, flist in duplicates.items():
+        reference, others = flist[0], flist[1:]
+        subgroups = []
+        for start in range(0, len(others), VERIFY_MAX_OPEN - 1):
+            batch = [reference] + others[start:start + VERIFY_MAX_OPEN - 1]
+            try:
+                groups, bytes_read = _verify_group([inventory.key_to_path(f) for f in batch], chunk_size)
+            except OSError as e:
+                logger.warning(f"Não foi possível verificar o grupo '{h}': {e}")
+                break
+            total_read += bytes_read
+            for group in groups:
+                members = [batch[i] for i in group]
+                # O primeiro arquivo aparece em todos os lotes; seus subgrupos são unidos
+                if reference in members and subgroups and reference in subgroups[0]:
+                    subgroups[0].extend(m for m in members if m != reference)
+                elif reference in members:
+                    subgroups.insert(0, members)
+                else:
+                    subgroups.append(members)
+
+        if len(subgroups) != 1 or len(subgroups[0]) != len(flist):
+            split += 1
+            logger.warning(f"Grupo '{h}' não é idêntico byte a byte; dividido em {len(subgroups)} subgrupo(s)")
+        for n, members in enumerate(subgroups):
+            verified[h if n == 0 else f"{h}#{n}"] = sorted(members)
+
+    logger.info(f"Verificação concluída: {len(verified)} grupos confirmados, {split} divergentes, {total_read} bytes lidos.")
+    if metrics is not None:
+        metrics["verify"] = {"groups": len(verified), "split": split, "bytes_read": total_read,
+                             "wall_seconds": time.perf_counter() - wall, "cpu_seconds": time.process_time() - cpu}
+    return verified
+
+
+# Quantidade de arquivos incorporados entre gravações do inventário
+INC_BATCH_SIZE = 1000
+
+
+def copy_file(src:Path, dst:Path):
+    """ Copia o conteúdo usando copy_file_range (cópia no kernel, sem passar pelo espaço de usuário) quando disponível """
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        if hasattr(os, "copy_file_range"):
+            try:
+                while os.copy_file_range(fsrc.fileno(), fdst.fileno(), 1024 * 1024 * 1024):
+                    pass
+                return
+            except OSError:
+                # Sistemas de arquivos sem suporte: recomeça com a cópia convencional
+                fsrc.seek(0)
+                fdst.seek(0)
+                fdst.truncate()
+        shutil.copyfileobj(fsrc, fdst, 1024 * 1024)
+
+
+def place_file(src:Path, src_stat:os.stat_result, dst:Path, move=False):
+    """
+    Coloca o arquivo no destino sem sobrescrever arquivos existentes.
+
+    No mesmo sistema de arquivos, a movimentação usa os.replace (apenas troca
+    de entrada de diretório). Caso contrário, o conteúdo é copiado para um nome
+    temporário no diretório de destino e renomeado ao final, de modo que um
+    arquivo incompleto nunca aparece com o nome definitivo.
+
+    Returns:
+        Path: Caminho final do arquivo (com sufixo " (n)" em caso de conflito de nome)
+    """
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    final = dst
+    n = 1
+    while final.exists():
+        final = dst.with_name(f"{dst.stem} ({n}){dst.suffix}")
+        n += 1
+
+    if move and src_stat.st_dev == os.stat(final.parent).st_dev:
+        os.replace(src, final)
+        return final
+
+    fd, tmp = tempfile.mkstemp(prefix=f".{final.name}.", suffix=".tmp", dir=final.parent)
+    os.close(fd)
+    try:
+        copy_file(src, Path(tmp))
+        shutil.copystat(src, tmp)
+        os.replace(tmp, final)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    if move:
+        os.remove(src)
+    return final
+
+
+def _match_candidates(path:Path, stat:os.stat_result, candidates, inventory:Inventory, alg, stages, io, drop_cache, verify):
+    """
+    Compara um arquivo de entrada com os arquivos do destino de mesmo tamanho,
+    etapa por etapa, parando assim que não restam candidatos.
+
+    Returns:
+        (str, dict): Chave do arquivo idêntico no destino (None se for único) e hashes calculados do arquivo de entrada
+    """
+    # Os hashes do inventário só valem se o candidato não mudou desde a
+    # varredura: um stat por candidato revalida tamanho, mtime e inode, e
+    # add_item descarta os hashes de arquivos alterados ou substituídos
+    size = stat.st_size
+    valid = []
+    for key in candidates:
+        target = inventory.key_to_path(key)
+        try:
+            target_stat = target.stat()
+        except FileNotFoundError:
+            inventory.remove_item(target)
+            continue
+        except OSError as e:
+            logger.warning(f"Arquivo inacessível: {target} - {e}")
+            continue
+        # O próprio arquivo de entrada nunca é seu duplicado (entrada dentro do
+        # destino, ou hardlink para um arquivo do destino)
+        if (target_stat.st_dev, target_stat.st_ino) == (stat.st_dev, stat.st_ino):
+            continue
+        inventory.add_item(target, target_stat)
+        if target_stat.st_size == size:
+            valid.append(key)
+    candidates = valid
+
+    hashes = {}
+    for stage in stages:
+        if not candidates:
+            break
+        if stage != "full" and stage_bytes(stage, size) >= size:
+            continue
+        field = HASH_STAGES[stage]
+        hashes[field] = compute_hash(path, alg=alg, ranges=stage_ranges(stage, size), io=io, drop_cache=drop_cache)
+
+        remaining = []
+        for key in candidates:
+            target = inventory.key_to_path(key)
+            item = inventory.get_item(target)
+            if not (item.get(field) and item.get("alg") == alg):
+                if item.get("alg") and item.get("alg") != alg:
+                    inventory.clear_hashes(target)
                 try:
-                    h = compute_hash(path, alg=alg, fast=True)
-                    inventory.update_item(path, hash_fast=h, alg=alg)
-                except FileNotFoundError:
-                    logger.warning(f"Arquivo inacessível: {f}")
-
-    iterable = inventory.get_by_hash_fast_list()
-    if USE_TQDM:
-        iterable = tqdm(iterable, desc="Hash completo")
-        for size, flist in iterable:
-            if len(flist) < 2:
+                    h = compute_hash(target, alg=alg, ranges=stage_ranges(stage, size), io=io, drop_cache=drop_cache)
+                except OSError as e:
+                    logger.warning(f"Arquivo inacessível: {target} - {e}")
+                    continue
+                inventory.update_item(target, alg=alg, **{field: h})
+                item = inventory.get_item(target)
+            if item[field] == hashes[field]:
+                remaining.append(key)
+        candidates = remaining
+
+    for key in candidates:
+        if not verify or _verify_group([path, inventory.key_to_path(key)], 1024 * 1024)[0]:
+            return key, hashes
+    return None, hashes
+
+
+def incorporate_files(files, input_dir:Path, output_dir:Path, inventory:Inventory, alg="md5", stages=None,
+                      move=False, delete=False, verify=False, io="auto", drop_cache=False):
+    """
+    Incorpora ao destino os arquivos de entrada que ainda não existem nele.
+
+    O inventário do destino funciona como índice: cada arquivo de entrada é
+    comparado apenas com os arquivos de mesmo tamanho, e os hashes (do arquivo
+    de entrada e dos candidatos) só são calculados quando há colisão, de modo
+    que o custo depende do volume de entrada e não do tamanho do destino.
+
+    Args:
+        files: Iterável de (Path, os.stat_result) da entrada, como devolvido por scan_files
+        input_dir (Path): Diretório de entrada
+        output_dir (Path): Diretório de destino
+        inventory (Inventory): Inventário do destino
+        alg="md5" (str): Algoritmo de hash
+        stages=None ([str]): Etapas de hash a executar (padrão: DEFAULT_STAGES)
+        move=False (bool): Move os arquivos únicos em vez de copiá-los
+        delete=False (bool): Deleta da entrada os arquivos que já existem no destino
+        verify=False (bool): Confirma byte a byte antes de considerar um arquivo duplicado
+        io="auto" (str): Estratégia de leitura (ver IO_STRATEGIES)
+        drop_cache=False (bool): Descarta as páginas lidas do cache do sistema
+
+    Returns:
+        dict: Contagem de arquivos incorporados, duplicados e bytes copiados
+    """
+    logger.info("Iniciando incorporação de arquivos..")
+    stages = [s for s in (stages or DEFAULT_STAGES) if s != "full"] + ["full"]
+    stats = {"incorporated": 0, "duplicates": 0, "bytes": 0, "errors": 0}
+
+    for n, (path, stat) in enumerate(files, start=1):
+        try:
+            match, hashes = _match_candidates(path, stat, inventory.get_by_size(stat.st_size), inventory,
+                                              alg, stages, io, drop_cache, verify)
+            if match is not None:
+                stats["duplicates"] += 1
+                if delete:
+                    os.remove(path)
+                    logger.info(f"[DEL] {path} (idêntico a {match})")
+                else:
+                    logger.info(f"[DUP] {path} (idêntico a {match})")
                 continue
-            for f in flist:
-                path = output_dir / Path(f)
-                try:
-                    h= compute_hash(path, alg=alg, fast=False)
-                    inventory.update_item(path, hash_full=h, alg=alg)
-                except FileNotFoundError:
-                    logger.warning(f"Arquivo inacessível: {f}")
 
-    return {h: flist for h, flist in inventory.get_by_hash_full_list() if len(flist) > 1}
+            final = place_file(path, stat, output_dir / path.relative_to(input_dir), move=move)
+            # Hashes já calculados acompanham o arquivo, evitando recálculo em duplicados da própria entrada
+            inventory.add_item(final)
+            if hashes:
+                inventory.update_item(final, alg=alg, **hashes)
+            stats["incorporated"] += 1
+            stats["bytes"] += stat.st_size
+            logger.info(f"[{'MOV' if move else 'CPY'}] {path} -> {inventory.path_to_key(final)}")
+        except OSError as e:
+            stats["errors"] += 1
+            logger.error(f"Falha ao incorporar {path} - {e}")
+
+        if n % INC_BATCH_SIZE == 0:
+            inventory.flush()
+    inventory.flush()
+
+    logger.info(f"Incorporação concluída: {stats['incorporated']} incorporados ({stats['bytes']} bytes), "
+                f"{stats['duplicates']} duplicados, {stats['errors']} erros.")
+    return stats
+
+
+# ioctl FICLONE (linux/fs.h): cria um reflink, compartilhando os blocos do arquivo (btrfs, XFS)
+FICLONE = 0x40049409
+LINK_MODES = ["hardlink", "reflink", "symlink"]
+
+
+def reflink_file(src:Path, dst:Path):
+    """ Cria dst como reflink de src; levanta OSError se o sistema de arquivos não suportar """
+    if not USE_FCNTL:
+        raise OSError(errno.EOPNOTSUPP, "Reflink não suportado nesta plataforma")
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+    shutil.copystat(src, dst)
+
+
+def link_file(keep:Path, dup:Path, mode:str):
+    """
+    Substitui dup por um link para keep, de forma atômica.
+
+    O link é criado com um nome temporário no mesmo diretório e então renomeado
+    sobre o duplicado com os.replace, de modo que o caminho nunca deixa de existir.
+
+    Quando o link não é possível (reflink não suportado pelo sistema de arquivos,
+    ou reflink/hardlink entre dispositivos diferentes), o duplicado é mantido:
+    um hardlink no lugar de um reflink faria as escritas em um caminho
+    aparecerem no outro.
+
+    Returns:
+        bool: True se o duplicado foi substituído, False se foi mantido
+    """
+    tmp = dup.with_name(f".{dup.name}.{os.getpid()}.lnk")
+    try:
+        if mode == "reflink":
+            reflink_file(keep, tmp)
+        elif mode == "hardlink":
+            os.link(keep, tmp)
+        elif mode == "symlink":
+            os.symlink(os.path.relpath(keep, dup.parent), tmp)
+        os.replace(tmp, dup)
+    except OSError as e:
+        if os.path.lexists(tmp):
+            os.unlink(tmp)
+        unsupported = (errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL, errno.ENOSYS) if mode == "reflink" else ()
+        if e.errno == errno.EXDEV or e.errno in unsupported:
+            logger.warning(f"{mode} não é possível para {dup} ({e.strerror}); duplicado mantido")
+            return False
+        raise
+    except BaseException:
+        if os.path.lexists(tmp):
+            os.unlink(tmp)
+        raise
+    return True
+
 
+def _fsync_dir(directory:Path):
+    """ Persiste as entradas de diretório alteradas (renomeações e remoções) """
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
 
-def delete_duplicates(duplicates, output_dir:Path, inventory:Inventory):
+
+def reclaimable_bytes(duplicates, inventory:Inventory):
+    """
+    Espaço que seria liberado mantendo apenas um arquivo de cada grupo.
+
+    Links físicos de um mesmo arquivo são contados uma única vez.
+
+    Returns:
+        dict: Hash -> bytes recuperáveis no grupo
+    """
+    reclaimable = {}
+    for h, flist in duplicates.items():
+        size = inventory.get_item(inventory.key_to_path(flist[0]))["size"]
+        reclaimable[h] = size * (_distinct_files(inventory, flist) - 1)
+    return reclaimable
+
+
+def write_report(report_file:Path, duplicates, inventory:Inventory, metrics:dict=None, **params):
+    """
+    Grava um relatório JSON da execução, com os grupos de duplicados, o espaço
+    recuperável e as métricas de cada etapa.
+
+    Args:
+        report_file (Path): Arquivo de saída
+        duplicates (dict): Hash -> lista de caminhos, como devolvido por find_duplicates
+        inventory (Inventory): Inventário usado para resolver tamanhos e inodes
+        metrics=None (dict): Métricas preenchidas por find_duplicates/verify_duplicates
+        **params: Parâmetros da execução a registrar no relatório
+    """
+    reclaimable = reclaimable_bytes(duplicates, inventory)
+    groups = []
+    for h, flist in duplicates.items():
+        groups.append({"hash": h, "size": inventory.get_item(inventory.key_to_path(flist[0]))["size"],
+                       "reclaimable_bytes": reclaimable[h], "files": flist})
+    report = {
+        "params": params,
+        "metrics": metrics or {},
+        "summary": {"groups": len(groups), "files": sum(len(g["files"]) for g in groups),
+                    "reclaimable_bytes": sum(reclaimable.values())},
+        "groups": groups,
+    }
+    tmp_file = report_file.with_name(f".{report_file.name}.tmp")
+    with open(tmp_file, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=4, ensure_ascii=False)
+    os.replace(tmp_file, report_file)
+    logger.info(f"Relatório gravado em {report_file}")
+
+
+def delete_duplicates(duplicates, output_dir:Path, inventory:Inventory, link:str=None):
+    """
+    Remove as cópias extras de cada grupo de duplicados, mantendo o primeiro arquivo.
+
+    Com 'link', cada cópia é substituída por um link para o arquivo mantido, em
+    vez de removida, preservando os caminhos usados pelas aplicações. As
+    operações são agrupadas por diretório, que é sincronizado ao final.
+
+    Args:
+        duplicates (dict): Hash -> lista de caminhos, como devolvido por find_duplicates
+        output_dir (Path): Diretório de destino
+        inventory (Inventory): Inventário a atualizar
+        link=None (str): Modo de link (ver LINK_MODES); None deleta os duplicados
+
+    Returns:
+        int: Total de bytes liberados
+    """
+    by_dir = defaultdict(list)
     for k in duplicates.keys():
         logger.info(f"Hash '{k}':")
         logger.info(f"[MANTER] {duplicates[k][0]}")
         for f in duplicates[k][1:]:
+            by_dir[inventory.key_to_path(f).parent].append((duplicates[k][0], f))
+
+    reclaimed = 0
+    for directory in sorted(by_dir.keys()):
+        for keep, f in by_dir[directory]:
+            keep_path = inventory.key_to_path(keep)
+            path = inventory.key_to_path(f)
             try:
-                os.remove(output_dir / Path(f))
-                inventory.remove_item(Path(f))
-                logger.info(f"[DEL] {f}")
+                keep_stat = keep_path.stat()
+                stat = path.stat(follow_symlinks=False)
+                if (stat.st_dev, stat.st_ino) == (keep_stat.st_dev, keep_stat.st_ino):
+                    logger.info(f"[IGNORAR] {f} (já é um link para {keep})")
+                    continue
+                # Só há espaço liberado quando esta era a última referência aos dados
+                freed = stat.st_size if stat.st_nlink == 1 else 0
+
+                if link is None:
+                    os.remove(path)
+                    inventory.remove_item(path)
+                    logger.info(f"[DEL] {f}")
+                else:
+                    if not link_file(keep_path, path, link):
+                        continue
+                    if link == "symlink":
+                        # Links simbólicos não são seguidos na varredura e saem do inventário
+                        inventory.remove_item(path)
+                    else:
+                        new_stat = path.stat()
+                        inventory.update_item(path, mtime_ns=new_stat.st_mtime_ns, ino=new_stat.st_ino, dev=new_stat.st_dev)
+                    logger.info(f"[{link.upper()}] {f} -> {keep}")
+                reclaimed += freed
             except Exception as e:
-                logger.error(f"Falha ao deletar {f} - {e}")
+                logger.error(f"Falha ao {'deletar' if link is None else 'vincular'} {f} - {e}")
+        _fsync_dir(directory)
+
+    inventory.flush()
+    logger.info(f"Espaço liberado: {reclaimed} bytes")
+    return reclaimed
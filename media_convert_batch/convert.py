@@ -1,8 +1,27 @@
 import os
+import re
+import csv
+import json
+import time
+import shlex
+import tempfile
+import sqlite3
 import subprocess
 import argparse
+import itertools
+import threading
+import urllib.parse
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 
+try:
+    import fcntl
 
+    USE_FCNTL = True
+except ImportError:
+    USE_FCNTL = False
+
+
+# Total CPU threads shared by all ffmpeg jobs (0 = all cores)
 NTHREADS = 0
 DELETE = True
 SUPPORTED_AUDIO_FORMATS = {"mp3", "wav"}
@@ -20,23 +39,63 @@ SUPPORTED_VIDEO_FORMATS = {
     "wmv",
     "flv",
 }
+# "codec" is the ffprobe codec_name the preset produces; inputs already in
+# that codec are remuxed or skipped instead of re-encoded
 VIDEO_PRESETS = {
     "COPY": {"ffpreset": "-c:a copy"},
-    "H264": {"mark": "(AVC)", "ffpreset": "-c:v libx264"},
-    "H265": {"mark": "(HEVC)", "ffpreset": "-c:v libx265"},
+    "H264": {"mark": "(AVC)", "ffpreset": "-c:v libx264", "codec": "h264"},
+    "H265": {"mark": "(HEVC)", "ffpreset": "-c:v libx265", "codec": "hevc"},
 }
 AUDIO_PRESETS = {
     # Copy audio codec
     "COPY": {"ffpreset": "-c:a copy"},
     # MP3 codec with default bitrate for all audio streams
-    "MP3_ALL": {"ffpreset": "-c:a mp3"},
+    "MP3_ALL": {"ffpreset": "-c:a mp3", "codec": "mp3"},
     # OPUS codec with 224kbps bitrate for all audio streams
-    "LIBOPUS_ALL_224K": {"ffpreset": "-c:a libopus -ac 2 -b:a 224000"},
+    "LIBOPUS_ALL_224K": {"ffpreset": "-c:a libopus -ac 2 -b:a 224000", "codec": "opus"},
     # OPUS codec with 224kbps bitrate for the first audio stream - #0
-    "LIBOPUS_0_224k": {"ffpreset": "-c:a:0 libopus -ac 2 -b:a 224000"},
+    "LIBOPUS_0_224k": {"ffpreset": "-c:a:0 libopus -ac 2 -b:a 224000", "codec": "opus"},
     # OPUS codec with 224kbps bitrate for the second audio stream - #1
-    "LIBOPUS_1_224k": {"ffpreset": "-c:a:1 libopus -ac 2 -b:a 224000"},
+    "LIBOPUS_1_224k": {"ffpreset": "-c:a:1 libopus -ac 2 -b:a 224000", "codec": "opus"},
+}
+# Throughput profiles: encoder speed/size trade-offs applied on top of the
+# video and audio presets. "crf" and "audio" are keyed by encoder.
+PROFILES = {
+    # Encoder defaults (x264/x265 "medium")
+    "DEFAULT": {},
+    # Fastest encode, largest files
+    "ULTRAFAST": {
+        "preset": "ultrafast",
+        "crf": {"libx264": 23, "libx265": 28},
+        "tune": "fastdecode",
+        "frame_threads": 4,
+        "audio": {"libopus": "-compression_level 0", "mp3": "-compression_level 9"},
+    },
+    "FAST": {
+        "preset": "veryfast",
+        "crf": {"libx264": 23, "libx265": 28},
+        "frame_threads": 3,
+        "audio": {"libopus": "-compression_level 5", "mp3": "-compression_level 7"},
+    },
+    "BALANCED": {
+        "preset": "fast",
+        "crf": {"libx264": 22, "libx265": 27},
+        "frame_threads": 2,
+    },
+    # Slowest encode, smallest files at the same quality
+    "COMPACT": {
+        "preset": "slow",
+        "crf": {"libx264": 21, "libx265": 26},
+        "frame_threads": 1,
+        "audio": {"libopus": "-compression_level 10", "mp3": "-compression_level 0"},
+    },
 }
+REMUX_PRESET = " -map 0:v -map 0:a? -c copy"
+PROBE_CACHE = ".media_convert_probe.json"
+STATE_DB = ".media_convert_state.sqlite"
+STATE_LOCK = ".media_convert_state.lock"
+RETRIES = 2
+PROGRESS_INTERVAL = 5
 
 
 # Text Colors
@@ -112,6 +171,88 @@ def parse_args():
     parser.add_argument(
         "-l", "--limit", default=0, type=int, help="Limit count of files to convert."
     )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        default=1,
+        type=int,
+        help="Number of ffmpeg processes to run concurrently. (default: 1)",
+    )
+    parser.add_argument(
+        "-t",
+        "--threads",
+        default=NTHREADS,
+        type=int,
+        help="Total CPU threads shared by all jobs; each job gets an equal share. 0=all cores. (default: 0)",
+    )
+    parser.add_argument(
+        "-P",
+        "--profile",
+        default="DEFAULT",
+        choices=PROFILES.keys(),
+        help="Encoder throughput profile (x264/x265 preset, crf, tune, frame threads, audio options). (default: DEFAULT)",
+    )
+    parser.add_argument(
+        "--calibrate",
+        default=False,
+        action="store_true",
+        help="Encode a short sample of the largest inputs with every profile, report fps and size ratio and use the fastest profile that meets --target-ratio/--target-ssim.",
+    )
+    parser.add_argument(
+        "--sample-seconds",
+        default=10,
+        type=int,
+        help="Length of the calibration samples in seconds. (default: 10)",
+    )
+    parser.add_argument(
+        "--calibrate-files",
+        default=3,
+        type=int,
+        help="Number of inputs sampled by --calibrate. (default: 3)",
+    )
+    parser.add_argument(
+        "--target-ratio",
+        default=None,
+        type=float,
+        help="Maximum output/input size ratio accepted by --calibrate, e.g. 0.5.",
+    )
+    parser.add_argument(
+        "--target-ssim",
+        default=None,
+        type=float,
+        help="Minimum SSIM against the source accepted by --calibrate, e.g. 0.98.",
+    )
+    parser.add_argument(
+        "-r",
+        "--retries",
+        default=RETRIES,
+        type=int,
+        help=f"Times a failed conversion is retried, counting previous runs. (default: {RETRIES})",
+    )
+    parser.add_argument(
+        "--reset-state",
+        default=False,
+        action="store_true",
+        help="Forget the conversion state stored in the output dir and process everything again.",
+    )
+    parser.add_argument(
+        "--progress-interval",
+        default=PROGRESS_INTERVAL,
+        type=float,
+        help=f"Seconds between progress lines of the running jobs. 0=disabled. (default: {PROGRESS_INTERVAL})",
+    )
+    parser.add_argument(
+        "-R",
+        "--report",
+        default=None,
+        help="Write per-file encode time, realtime factor and size ratio to a JSON or CSV file (by extension).",
+    )
+    parser.add_argument(
+        "--no-probe",
+        default=False,
+        action="store_true",
+        help="Don't inspect files with ffprobe; convert everything matched by extension.",
+    )
 
     params = parser.parse_args()
 
@@ -120,13 +261,143 @@ def parse_args():
 
 def get_input_formats(mode):
     if mode == "ALL":
-        return SUPPORTED_VIDEO_FORMATS + SUPPORTED_AUDIO_FORMATS
+        return SUPPORTED_VIDEO_FORMATS | SUPPORTED_AUDIO_FORMATS
     elif mode == "VIDEO":
         return SUPPORTED_VIDEO_FORMATS
     elif mode == "AUDIO":
         return SUPPORTED_AUDIO_FORMATS
 
 
+def probe_file(in_file):
+    """Return the ffprobe stream/format info of a file, or None if it can't be probed."""
+    try:
+        result = subprocess.run(
+            [
+                "ffprobe",
+                "-v",
+                "error",
+                "-print_format",
+                "json",
+                "-show_streams",
+                "-show_format",
+                in_file,
+            ],
+            stdin=subprocess.DEVNULL,
+            capture_output=True,
+        )
+    except FileNotFoundError:
+        return None
+    if result.returncode != 0:
+        return None
+    info = json.loads(result.stdout or "{}")
+    duration = info.get("format", {}).get("duration")
+    return {
+        "format": info.get("format", {}).get("format_name", ""),
+        "duration": float(duration) if duration else None,
+        "streams": [
+            {"type": st.get("codec_type"), "codec": st.get("codec_name")}
+            for st in info.get("streams", [])
+        ],
+    }
+
+
+def load_probe_cache(output_dir):
+    try:
+        with open(os.path.join(output_dir, PROBE_CACHE), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_probe_cache(output_dir, cache):
+    os.makedirs(output_dir, exist_ok=True)
+    cache_file = os.path.join(output_dir, PROBE_CACHE)
+    tmp_file = cache_file + ".tmp"
+    with open(tmp_file, "w", encoding="utf-8") as f:
+        json.dump(cache, f)
+    os.replace(tmp_file, cache_file)
+
+
+def probe_files(files, cache, jobs=4):
+    """
+    Probe files in parallel. Results found in the cache (see load_probe_cache)
+    are reused while the file's size and mtime don't change, and new ones are
+    added to it.
+
+    Returns (probes, number of files actually probed).
+    """
+    result = {}
+    to_probe = []
+    for in_file in files:
+        st = os.stat(in_file)
+        entry = cache.get(in_file)
+        if entry and entry["size"] == st.st_size and entry["mtime_ns"] == st.st_mtime_ns:
+            result[in_file] = entry["probe"]
+        else:
+            to_probe.append((in_file, st))
+
+    if to_probe:
+        with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+            probes = executor.map(probe_file, [in_file for in_file, _ in to_probe])
+            for (in_file, st), probe in zip(to_probe, probes):
+                result[in_file] = probe
+                if probe is not None:
+                    cache[in_file] = {
+                        "size": st.st_size,
+                        "mtime_ns": st.st_mtime_ns,
+                        "probe": probe,
+                    }
+
+    return result, len(to_probe)
+
+
+def decide_action(probe, video_preset, audio_preset, in_format, output_format):
+    """
+    Choose what to do with a file given its probe info.
+
+    Returns (action, reason), where action is "convert", "remux" (stream copy
+    into the output container) or "skip".
+    """
+    if probe is None:
+        return "convert", "not probed"
+    video = [st["codec"] for st in probe["streams"] if st["type"] == "video"]
+    audio = [st["codec"] for st in probe["streams"] if st["type"] == "audio"]
+    video_codec = VIDEO_PRESETS[video_preset].get("codec")
+    audio_codec = (
+        AUDIO_PRESETS[audio_preset].get("codec") if audio_preset is not None else None
+    )
+
+    if video_codec and any(codec != video_codec for codec in video):
+        return "convert", f"video {','.join(video)} -> {video_codec}"
+    if audio_codec and any(codec != audio_codec for codec in audio):
+        return "convert", f"audio {','.join(audio)} -> {audio_codec}"
+    codecs = ",".join(video + audio) or "no streams"
+    if in_format == output_format:
+        return "skip", f"already {codecs} in {output_format}"
+    return "remux", f"already {codecs}, {in_format} -> {output_format}"
+
+
+def profile_options(ffpreset, profile):
+    """ffmpeg options of a throughput profile for the encoders used in ffpreset."""
+    settings = PROFILES[profile]
+    options = []
+    for encoder in ("libx264", "libx265"):
+        if encoder not in ffpreset:
+            continue
+        if "preset" in settings:
+            options.append(f"-preset {settings['preset']}")
+        if encoder in settings.get("crf", {}):
+            options.append(f"-crf {settings['crf'][encoder]}")
+        if "tune" in settings:
+            options.append(f"-tune {settings['tune']}")
+        if encoder == "libx265" and "frame_threads" in settings:
+            options.append(f"-x265-params frame-threads={settings['frame_threads']}")
+    for encoder in set(re.findall(r"-c:a(?::\d+)?\s+(\S+)", ffpreset)):
+        if encoder in settings.get("audio", {}):
+            options.append(settings["audio"][encoder])
+    return " ".join(options)
+
+
 def list_files(
     input_dir,
     output_dir,
@@ -136,54 +407,124 @@ def list_files(
     input_format=None,
     output_format=None,
     limit=0,
+    probe=True,
+    probe_jobs=4,
+    state=None,
+    retries=RETRIES,
+    profile="DEFAULT",
+    save_cache=True,
 ):
     batch = {}
     if input_format is None:
         input_format = get_input_formats(mode)
 
-    for root, dirs, files in os.walk(input_dir, topdown=True):
-        for name in files:
-
-            mark = "."
-            if any(name.lower().endswith(ext) for ext in SUPPORTED_VIDEO_FORMATS):
-                mark = VIDEO_PRESETS[video_preset]["mark"]
-                if output_format is None:
-                    output_format = "mkv"
-            elif (
-                any(name.lower().endswith(ext) for ext in SUPPORTED_AUDIO_FORMATS)
-                and output_format is None
-            ):
-                output_format = "mp3"
-
-            if (
-                any(name.lower().endswith(ext) for ext in input_format)
-                and mark not in name
-            ):
-                in_file = os.path.join(root, name)
-
-                ffpreset = " -map 0:v -map 0:a? -c copy {} {}".format(
-                    VIDEO_PRESETS[video_preset]["ffpreset"],
-                    (
-                        AUDIO_PRESETS[audio_preset]["ffpreset"]
-                        if audio_preset is not None
-                        else ""
-                    ),
-                )
+    def candidates():
+        nonlocal output_format
+        for root, dirs, files in os.walk(input_dir, topdown=True):
+            for name in files:
+                # Leftover output of an interrupted job
+                if name.startswith(".") and ".partial." in name:
+                    continue
+
+                mark = None
+                if any(name.lower().endswith(ext) for ext in SUPPORTED_VIDEO_FORMATS):
+                    mark = VIDEO_PRESETS[video_preset].get("mark")
+                    if output_format is None:
+                        output_format = "mkv"
+                elif (
+                    any(name.lower().endswith(ext) for ext in SUPPORTED_AUDIO_FORMATS)
+                    and output_format is None
+                ):
+                    output_format = "mp3"
+
+                if any(name.lower().endswith(ext) for ext in input_format) and not (
+                    mark and mark in name
+                ):
+                    in_file = os.path.join(root, name)
+
+                    ffpreset = " -map 0:v -map 0:a? -c copy {} {}".format(
+                        VIDEO_PRESETS[video_preset]["ffpreset"],
+                        (
+                            AUDIO_PRESETS[audio_preset]["ffpreset"]
+                            if audio_preset is not None
+                            else ""
+                        ),
+                    )
+                    options = profile_options(ffpreset, profile)
+                    if options:
+                        ffpreset += " " + options
+
+                    base = name.rsplit(".", 1)[0]
+                    out_file = os.path.join(
+                        root,
+                        "{}.{}.{}".format(base, mark, output_format)
+                        if mark
+                        else "{}.{}".format(base, output_format),
+                    )
+                    if output_dir != input_dir:
+                        out_file = out_file.replace(input_dir, output_dir)
 
-                out_file = os.path.join(
-                    root, "{}.{}.{}".format(name.rsplit(".", 1)[0], mark, output_format)
+                    yield in_file, {
+                        "out_file": out_file,
+                        "ffpreset": ffpreset,
+                        "size": os.path.getsize(in_file),
+                        "mtime_ns": os.stat(in_file).st_mtime_ns,
+                        "format": name.rsplit(".", 1)[-1].lower(),
+                        "action": "convert",
+                        "reason": "",
+                        "duration": None,
+                    }
+
+    cache = load_probe_cache(output_dir) if probe else None
+    probed = 0
+    probe_failed = True
+    selected = 0
+    found = candidates()
+    while limit == 0 or selected < limit:
+        # With a limit, files are probed in small chunks and the walk stops as
+        # soon as enough files to process are found
+        chunk_size = max(probe_jobs, limit) if limit > 0 else None
+        chunk = dict(itertools.islice(found, chunk_size))
+        if not chunk:
+            break
+
+        if probe:
+            probes, count = probe_files(chunk.keys(), cache, probe_jobs)
+            probed += count
+            probe_failed = probe_failed and all(p is None for p in probes.values())
+            for in_file, file in chunk.items():
+                file["action"], file["reason"] = decide_action(
+                    probes.get(in_file),
+                    video_preset,
+                    audio_preset,
+                    file["format"],
+                    output_format,
                 )
-                if output_dir != input_dir:
-                    out_file = out_file.replace(input_dir, output_dir)
-
-                file = {
-                    "out_file": out_file,
-                    "ffpreset": ffpreset,
-                    "size": os.path.getsize(in_file),
-                }
-                batch[in_file] = file
-                if limit > 0 and len(batch.keys()) + 1 > limit:
-                    return batch
+                if probes.get(in_file):
+                    file["duration"] = probes[in_file].get("duration")
+                if file["action"] == "remux":
+                    file["ffpreset"] = REMUX_PRESET
+
+        for in_file, file in chunk.items():
+            # ffmpeg can't write over the file it is reading
+            if file["action"] != "skip" and file["out_file"] == in_file:
+                file["action"], file["reason"] = "skip", "output would overwrite input"
+
+        if state is not None:
+            apply_state(chunk, state, retries)
+
+        for in_file, file in chunk.items():
+            if file["action"] != "skip":
+                if limit > 0 and selected >= limit:
+                    continue
+                selected += 1
+            batch[in_file] = file
+
+    if probe and batch and probe_failed:
+        print(p_color.red("ffprobe unavailable or failed; converting all files"))
+    # Dry runs write nothing to the output dir
+    if probed and save_cache:
+        save_probe_cache(output_dir, cache)
 
     return batch
 
@@ -205,55 +546,609 @@ def print_file(file, count=0, total=0):
     print(p_color.cyan(f'"{k}" - {b} - {count}/{total}'))
 
 
+def print_action(file):
+    action = file["action"].upper()
+    reason = f' ({file["reason"]})' if file["reason"] else ""
+    color = p_color.blue if file["action"] == "skip" else p_color.yellow
+    print(color(f"  {action}{reason}"))
+
+
 def print_filelist(filelist):
     tot_bytes = 0
     tot_files = len(filelist.keys())
     count = 1
     for k in sorted(filelist.keys()):
         print_file({k: filelist[k]}, count, tot_files)
+        print_action(filelist[k])
         count += 1
-        tot_bytes += filelist[k]["size"]
+        if filelist[k]["action"] != "skip":
+            tot_bytes += filelist[k]["size"]
     return tot_bytes
 
 
-def convert_filelist(filelist, preserve_files):
-    tot_bytes_prev = 0
-    tot_bytes_after = 0
-    tot_files = len(filelist.keys())
-    count = 1
-    for k in sorted(filelist.keys()):
-        print_file({k: filelist[k]}, count, tot_files)
-        tot_bytes_prev += filelist[k]["size"]
+def thread_budget(jobs, threads=NTHREADS):
+    """Threads given to each ffmpeg job so that all jobs together use at most `threads` cores."""
+    if threads <= 0:
+        threads = os.cpu_count() or 1
+    return max(1, threads // max(1, jobs))
+
+
+def thread_options(ffpreset, threads):
+    # libx265 ignores -threads and sizes its own thread pool, so cap it explicitly
+    if "-x265-params " in ffpreset:
+        # More frame threads than pool threads only adds lookahead latency
+        ffpreset = re.sub(
+            r"frame-threads=(\d+)",
+            lambda m: f"frame-threads={min(int(m.group(1)), threads)}",
+            ffpreset,
+        )
+        return ffpreset.replace("-x265-params ", f"-x265-params pools={threads}:")
+    if "libx265" in ffpreset:
+        return ffpreset + f" -x265-params pools={threads}"
+    return ffpreset
+
+
+def build_command(in_file, file, threads):
+    ffpreset = thread_options(file["ffpreset"], threads)
+    return [
+        "ffmpeg",
+        "-nostdin",
+        "-i",
+        in_file,
+        "-threads",
+        str(threads),
+        *shlex.split(ffpreset),
+        "-progress",
+        "pipe:1",
+        "-nostats",
+        file["out_file"],
+        "-y",
+    ]
+
+
+def encode_sample(in_file, file, ffpreset, threads, sample_seconds, out_file, ssim=False):
+    """
+    Encode a sample from the middle of the input and measure it.
+
+    Returns a dict with the encode fps, the output/input size ratio (when the
+    input duration is known) and the SSIM against the source (if requested),
+    or None if ffmpeg failed.
+    """
+    duration = file.get("duration")
+    start = max(0.0, duration / 2 - sample_seconds / 2) if duration else 0.0
+    command = [
+        "ffmpeg",
+        "-ss",
+        f"{start:.3f}",
+        "-t",
+        str(sample_seconds),
+        "-i",
+        in_file,
+        "-map",
+        "0:v:0",
+        "-an",
+        "-sn",
+        "-threads",
+        str(threads),
+        *shlex.split(thread_options(ffpreset, threads)),
+        out_file,
+        "-y",
+    ]
+    begin = time.perf_counter()
+    result = subprocess.run(command, stdin=subprocess.DEVNULL, capture_output=True)
+    elapsed = time.perf_counter() - begin
+    if result.returncode != 0:
+        return None
+
+    frames = re.findall(r"frame=\s*(\d+)", result.stderr.decode(errors="replace"))
+    measures = {
+        "fps": int(frames[-1]) / elapsed if frames and elapsed > 0 else 0.0,
+        "ratio": None,
+        "ssim": None,
+    }
+    if duration:
+        sample_bytes = file["size"] * min(sample_seconds, duration) / duration
+        measures["ratio"] = os.path.getsize(out_file) / sample_bytes
+    if ssim:
+        command = [
+            "ffmpeg",
+            "-i",
+            out_file,
+            "-ss",
+            f"{start:.3f}",
+            "-t",
+            str(sample_seconds),
+            "-i",
+            in_file,
+            "-lavfi",
+            "[0:v][1:v:0]ssim",
+            "-f",
+            "null",
+            "-",
+        ]
+        result = subprocess.run(command, stdin=subprocess.DEVNULL, capture_output=True)
+        values = re.findall(r"All:([\d.]+)", result.stderr.decode(errors="replace"))
+        if values:
+            measures["ssim"] = float(values[-1])
+    return measures
+
+
+def calibrate(
+    filelist,
+    video_preset,
+    threads,
+    sample_seconds=10,
+    max_files=3,
+    target_ratio=None,
+    target_ssim=None,
+):
+    """
+    Encode samples of the largest inputs with every profile and return the
+    fastest profile that meets the size ratio and SSIM targets, along with the
+    measurements. Without a qualifying profile, the one with the smallest
+    output is chosen.
+    """
+    candidates = sorted(
+        (k for k in filelist.keys() if filelist[k]["action"] == "convert"),
+        key=lambda k: filelist[k]["size"],
+        reverse=True,
+    )[:max_files]
+    if not candidates:
+        print(p_color.yellow("Nothing to calibrate"))
+        return None, []
+
+    results = []
+    ffpreset = VIDEO_PRESETS[video_preset]["ffpreset"]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for profile in PROFILES.keys():
+            options = profile_options(ffpreset, profile)
+            samples = []
+            for n, k in enumerate(candidates):
+                out_file = os.path.join(tmp_dir, f"{profile}.{n}.mkv")
+                measures = encode_sample(
+                    k,
+                    filelist[k],
+                    f"{ffpreset} {options}",
+                    threads,
+                    sample_seconds,
+                    out_file,
+                    target_ssim is not None,
+                )
+                if measures is not None:
+                    samples.append(measures)
+            if not samples:
+                print(p_color.red(f"{profile}: sample encode failed"))
+                continue
+
+            result = {"profile": profile}
+            for key in ("fps", "ratio", "ssim"):
+                values = [m[key] for m in samples if m[key] is not None]
+                result[key] = sum(values) / len(values) if values else None
+            results.append(result)
+            ratio = f"{result['ratio']:.3f}" if result["ratio"] is not None else "?"
+            ssim = f"{result['ssim']:.4f}" if result["ssim"] is not None else "-"
+            print(
+                p_color.cyan(
+                    f"{profile:<10} fps: {result['fps']:8.1f}  size ratio: {ratio:>6}  ssim: {ssim}"
+                )
+            )
 
-        parent_dir = os.path.dirname(filelist[k]["out_file"])
-        if not (os.path.exists(parent_dir) and os.path.isdir(parent_dir)):
-            os.makedirs(parent_dir)
+    def meets(result):
+        if target_ratio is not None and (
+            result["ratio"] is None or result["ratio"] > target_ratio
+        ):
+            return False
+        if target_ssim is not None and (
+            result["ssim"] is None or result["ssim"] < target_ssim
+        ):
+            return False
+        return True
 
-        command = (
-            f'ffmpeg -i "{k}" {filelist[k]["ffpreset"]} "{filelist[k]["out_file"]}" -y'
+    if not results:
+        return None, results
+    eligible = [r for r in results if meets(r)]
+    if eligible:
+        best = max(eligible, key=lambda r: r["fps"])
+    else:
+        print(p_color.yellow("No profile meets the targets; using the smallest output"))
+        best = min(
+            results, key=lambda r: r["ratio"] if r["ratio"] is not None else float("inf")
+        )
+    print(p_color.green(f"Chosen profile: {best['profile']}"))
+    return best["profile"], results
+
+
+class ConversionState:
+    """
+    Conversion state of each input, stored in a SQLite file in the output dir.
+
+    An input is done while its size, mtime and ffmpeg preset stay the same as
+    when it was converted. Jobs left "running" by an interrupted run are reset
+    to pending and their partial outputs removed, under an exclusive lock so a
+    run never resets the jobs of another one using the same output dir.
+
+    Opened read_only (for dry runs), nothing is created, locked or recovered.
+    """
+
+    def __init__(self, output_dir, reset=False, read_only=False):
+        self.db_file = os.path.join(output_dir, STATE_DB)
+        self.lock = None
+        if read_only:
+            uri = "file:{}?mode=ro".format(
+                urllib.parse.quote(os.path.abspath(self.db_file))
+            )
+            self.conn = sqlite3.connect(uri, uri=True)
+            return
+
+        os.makedirs(output_dir, exist_ok=True)
+        if USE_FCNTL:
+            self.lock = open(os.path.join(output_dir, STATE_LOCK), "w")
+            try:
+                fcntl.flock(self.lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                self.lock.close()
+                raise RuntimeError(f'Another run is using "{output_dir}"')
+        self.conn = sqlite3.connect(self.db_file)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS jobs (
+                in_file TEXT PRIMARY KEY,
+                size INTEGER,
+                mtime_ns INTEGER,
+                preset TEXT,
+                status TEXT,
+                attempts INTEGER DEFAULT 0,
+                out_file TEXT,
+                partial_file TEXT,
+                out_size INTEGER,
+                duration REAL,
+                error TEXT,
+                updated_at REAL
+            )"""
         )
-        print(p_color.yellow(command))
+        self.conn.commit()
+        # Partial outputs of interrupted jobs are removed before the state that
+        # knows about them is forgotten
+        self.recover()
+        if reset:
+            self.conn.execute("DELETE FROM jobs")
+            self.conn.commit()
+
+    def recover(self):
+        rows = self.conn.execute(
+            "SELECT in_file, partial_file FROM jobs WHERE status = 'running'"
+        ).fetchall()
+        for in_file, partial_file in rows:
+            if partial_file and os.path.exists(partial_file):
+                print(p_color.blue(f'Remove partial output "{partial_file}"'))
+                os.remove(partial_file)
+        if rows:
+            print(p_color.yellow(f"{len(rows)} interrupted job(s) reset to pending"))
+        self.conn.execute("UPDATE jobs SET status = 'pending' WHERE status = 'running'")
+        self.conn.commit()
+
+    def get(self, in_file, file):
+        """Return (status, attempts) for the input, or ("pending", 0) if it changed since."""
+        row = self.conn.execute(
+            "SELECT size, mtime_ns, preset, status, attempts FROM jobs WHERE in_file = ?",
+            (in_file,),
+        ).fetchone()
+        if row is None:
+            return "pending", 0
+        size, mtime_ns, preset, status, attempts = row
+        if (size, mtime_ns, preset) != (file["size"], file["mtime_ns"], file["ffpreset"]):
+            return "pending", 0
+        return status, attempts
+
+    def update(self, in_file, file, status, **values):
+        old_status, attempts = self.get(in_file, file)
+        if status == "running":
+            attempts += 1
+        values = {
+            "size": file["size"],
+            "mtime_ns": file["mtime_ns"],
+            "preset": file["ffpreset"],
+            "status": status,
+            "attempts": attempts,
+            "out_file": file["out_file"],
+            "updated_at": time.time(),
+            **values,
+        }
+        columns = ", ".join(values.keys())
+        placeholders = ", ".join("?" for _ in values)
+        self.conn.execute(
+            f"INSERT OR REPLACE INTO jobs (in_file, {columns}) VALUES (?, {placeholders})",
+            (in_file, *values.values()),
+        )
+        self.conn.commit()
+        return attempts
+
+    def close(self):
+        self.conn.close()
+        if self.lock is not None:
+            self.lock.close()
+
+
+def apply_state(filelist, state, retries=RETRIES):
+    """Mark as skipped the files finished in a previous run and the ones out of retries."""
+    for in_file, file in filelist.items():
+        if file["action"] == "skip":
+            continue
+        status, attempts = state.get(in_file, file)
+        if status == "done" and os.path.exists(file["out_file"]):
+            file["action"], file["reason"] = "skip", "done in a previous run"
+        elif status == "failed" and attempts > retries:
+            file["action"], file["reason"] = "skip", f"failed {attempts} times"
+
+
+def partial_path(out_file):
+    """Temporary name the output is written to until ffmpeg finishes."""
+    parent_dir, name = os.path.split(out_file)
+    base, ext = os.path.splitext(name)
+    return os.path.join(parent_dir, f".{base}.partial{ext}")
+
 
+def parse_progress(values):
+    """Convert the key=value block of ffmpeg -progress into numbers."""
+
+    def number(key, cast=float):
         try:
-            process = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE)
-            process.wait()
-            if process.returncode == 0:
-                tot_bytes_after += os.path.getsize(filelist[k]["out_file"])
-                if not preserve_files and os.path.exists(k):
-                    print(p_color.blue(f'Delete "{k}"'))
-                    os.remove(k)
-        except KeyboardInterrupt:
-            print(p_color.red("Keyboard Interrupt!"))
-            return (
-                count - 1,
-                tot_files,
-                tot_bytes_prev - filelist[k]["size"],
-                tot_bytes_after,
+            return cast(values.get(key, "").rstrip("x"))
+        except ValueError:
+            return None
+
+    out_time_us = number("out_time_us", int)
+    return {
+        "frame": number("frame", int),
+        "fps": number("fps"),
+        "speed": number("speed"),
+        "out_time": out_time_us / 1000000 if out_time_us is not None else None,
+        "total_size": number("total_size", int),
+    }
+
+
+def format_eta(seconds):
+    if seconds is None:
+        return "?"
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}"
+
+
+def print_progress(filelist, progress):
+    for k, current in sorted(progress.items()):
+        duration = filelist[k].get("duration")
+        eta = None
+        if duration and current["out_time"] is not None and current["speed"]:
+            eta = max(0.0, duration - current["out_time"]) / current["speed"]
+        fps = f"{current['fps']:.1f}" if current["fps"] is not None else "?"
+        speed = f"{current['speed']:.2f}x" if current["speed"] is not None else "?"
+        written = bytes_to_human(current["total_size"] or 0)
+        print(
+            p_color.white(
+                f'  "{os.path.basename(k)}" - {fps} fps - {speed} - ETA {format_eta(eta)} - {written}'
             )
+        )
 
-        count += 1
 
-    return count - 1, tot_files, tot_bytes_prev, tot_bytes_after
+def run_job(in_file, file, threads, preserve_files, running, progress):
+    """
+    Run one conversion, buffering its log so parallel jobs don't interleave.
+
+    ffmpeg reports its progress as key=value blocks on stdout; the latest
+    block is kept in progress[in_file]. stderr is drained by a separate
+    thread so neither pipe can fill up and block ffmpeg.
+    """
+    parent_dir = os.path.dirname(file["out_file"])
+    if parent_dir and not (os.path.exists(parent_dir) and os.path.isdir(parent_dir)):
+        os.makedirs(parent_dir, exist_ok=True)
+
+    # ffmpeg writes to a temporary name so an interrupted job never leaves a
+    # truncated file under the final name
+    partial_file = partial_path(file["out_file"])
+    command = build_command(in_file, {**file, "out_file": partial_file}, threads)
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        command,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    running.add(process)
+    stderr = []
+    reader = threading.Thread(target=lambda: stderr.append(process.stderr.read()))
+    reader.start()
+    last = {}
+    try:
+        values = {}
+        for line in process.stdout:
+            key, _, value = line.decode(errors="replace").strip().partition("=")
+            values[key] = value
+            if key == "progress":
+                last = parse_progress(values)
+                progress[in_file] = last
+        process.wait()
+        reader.join()
+    finally:
+        running.discard(process)
+        progress.pop(in_file, None)
+        if process.returncode != 0 and os.path.exists(partial_file):
+            os.remove(partial_file)
+    elapsed = time.perf_counter() - start
+
+    result = {
+        "command": command,
+        "returncode": process.returncode,
+        "output": b"".join(stderr).decode(errors="replace"),
+        "encode_seconds": elapsed,
+        "fps": last.get("fps"),
+        "out_size": 0,
+        "deleted": False,
+    }
+    if process.returncode == 0:
+        os.replace(partial_file, file["out_file"])
+        result["out_size"] = os.path.getsize(file["out_file"])
+        if not preserve_files and os.path.exists(in_file):
+            os.remove(in_file)
+            result["deleted"] = True
+    return result
+
+
+def report_row(in_file, file, result, attempts):
+    duration = file.get("duration")
+    done = result["returncode"] == 0
+    return {
+        "in_file": in_file,
+        "out_file": file["out_file"],
+        "action": file["action"],
+        "status": "done" if done else "failed",
+        "attempts": attempts,
+        "in_size": file["size"],
+        "out_size": result["out_size"],
+        "size_ratio": result["out_size"] / file["size"] if done and file["size"] else None,
+        "media_seconds": duration,
+        "encode_seconds": round(result["encode_seconds"], 3),
+        "realtime_factor": duration / result["encode_seconds"] if done and duration and result["encode_seconds"] else None,
+        "fps": result["fps"],
+    }
+
+
+def write_report(report_file, rows):
+    """Write the per-file results as CSV or JSON, depending on the extension."""
+    tmp_file = report_file + ".tmp"
+    with open(tmp_file, "w", encoding="utf-8", newline="") as f:
+        if report_file.lower().endswith(".csv"):
+            writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()) if rows else ["in_file"])
+            writer.writeheader()
+            writer.writerows(rows)
+        else:
+            json.dump(rows, f, indent=4)
+    os.replace(tmp_file, report_file)
+    print(p_color.white(f'Report: "{report_file}"'))
+
+
+def convert_filelist(
+    filelist,
+    preserve_files,
+    jobs=1,
+    threads=NTHREADS,
+    state=None,
+    retries=RETRIES,
+    progress_interval=PROGRESS_INTERVAL,
+    report=None,
+):
+    tot_bytes_prev = 0
+    tot_bytes_after = 0
+    skipped = [k for k in filelist.keys() if filelist[k]["action"] == "skip"]
+    if skipped:
+        print(p_color.blue(f"Skipping {len(skipped)} file(s) already in the target format or done"))
+    filelist = {k: v for k, v in filelist.items() if v["action"] != "skip"}
+    tot_files = len(filelist.keys())
+    count = 0
+    job_threads = thread_budget(jobs, threads)
+    print(p_color.white(f"Jobs: {jobs} x {job_threads} threads"))
+
+    # Largest files first: the longest encodes start early and small ones fill the gaps
+    order = sorted(filelist.keys(), key=lambda k: filelist[k]["size"], reverse=True)
+    running = set()
+    progress = {}
+    executor = ThreadPoolExecutor(max_workers=max(1, jobs))
+    futures = {}
+    attempts = {}
+
+    def submit(k):
+        if state is not None:
+            attempts[k] = state.update(
+                k, filelist[k], "running", partial_file=partial_path(filelist[k]["out_file"])
+            )
+        futures[
+            executor.submit(
+                run_job, k, filelist[k], job_threads, preserve_files, running, progress
+            )
+        ] = k
+
+    try:
+        # Jobs are submitted as slots free up, so "running" in the state
+        # database means an ffmpeg process was actually started
+        while order and len(futures) < max(1, jobs):
+            submit(order.pop(0))
+        while futures:
+            done, _ = wait(
+                futures.keys(),
+                timeout=progress_interval or None,
+                return_when=FIRST_COMPLETED,
+            )
+            if not done:
+                print_progress(filelist, dict(progress))
+            for future in done:
+                k = futures.pop(future)
+                try:
+                    result = future.result()
+                except OSError as e:
+                    result = {
+                        "command": None,
+                        "returncode": -1,
+                        "output": str(e),
+                        "encode_seconds": 0.0,
+                        "fps": None,
+                        "out_size": 0,
+                        "deleted": False,
+                    }
+                returncode = result["returncode"]
+                retry = returncode != 0 and attempts.get(k, retries + 1) <= retries
+                if not retry:
+                    count += 1
+                    if report is not None:
+                        report.append(report_row(k, filelist[k], result, attempts.get(k, 1)))
+                print_file({k: filelist[k]}, count, tot_files)
+                print_action(filelist[k])
+                if result["command"]:
+                    print(p_color.yellow(shlex.join(result["command"])))
+                if returncode == 0:
+                    tot_bytes_prev += filelist[k]["size"]
+                    tot_bytes_after += result["out_size"]
+                    if state is not None:
+                        state.update(
+                            k,
+                            filelist[k],
+                            "done",
+                            out_size=result["out_size"],
+                            duration=result["encode_seconds"],
+                            error=None,
+                        )
+                    print(
+                        p_color.green(
+                            f'Done in {format_eta(result["encode_seconds"])} - {bytes_to_human(result["out_size"])}'
+                        )
+                    )
+                    if result["deleted"]:
+                        print(p_color.blue(f'Delete "{k}"'))
+                else:
+                    print(result["output"])
+                    print(p_color.red(f'ffmpeg exited with code {returncode}: "{k}"'))
+                    if state is not None:
+                        state.update(
+                            k,
+                            filelist[k],
+                            "failed",
+                            duration=result["encode_seconds"],
+                            error=result["output"][-2000:],
+                        )
+                    if retry:
+                        print(p_color.yellow(f'Retrying "{k}" (attempt {attempts[k] + 1} of {retries + 1})'))
+                        order.append(k)
+            while order and len(futures) < max(1, jobs):
+                submit(order.pop(0))
+    except KeyboardInterrupt:
+        print(p_color.red("Keyboard Interrupt!"))
+        executor.shutdown(wait=False, cancel_futures=True)
+        for process in list(running):
+            process.terminate()
+        return count, tot_files, tot_bytes_prev, tot_bytes_after
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+    return count, tot_files, tot_bytes_prev, tot_bytes_after
 
 
 def print_params(params):
@@ -281,6 +1176,11 @@ def print_params(params):
     print(f"Preserve Files: ", "No" if params.preserve_files == False else "Yes")
     print(f"Just Print: ", "No" if params.just_print == False else "Yes")
     print(f"Limit: ", "All" if params.limit == 0 else params.limit)
+    print(f"Probe: ", "No" if params.no_probe else "Yes")
+    print(f"Profile: ", params.profile, "(calibrate)" if params.calibrate else "")
+    print(f"Retries: ", params.retries)
+    print(f"Jobs: ", params.jobs)
+    print(f"Threads: ", "All" if params.threads == 0 else params.threads)
 
 
 def main():
@@ -291,6 +1191,21 @@ def main():
 
     print_params(params)
 
+    if not params.just_print:
+        try:
+            state = ConversionState(params.output_dir, params.reset_state)
+        except RuntimeError as e:
+            print(p_color.red(e))
+            quit()
+    elif (
+        os.path.exists(os.path.join(params.output_dir, STATE_DB))
+        and not params.reset_state
+    ):
+        # A dry run only reads the state, leaving a run in progress untouched
+        state = ConversionState(params.output_dir, read_only=True)
+    else:
+        state = None
+
     print(p_color.white("Searching for files..."))
     filelist = list_files(
         params.input_dir,
@@ -301,21 +1216,69 @@ def main():
         params.input_format,
         params.output_format,
         params.limit,
+        not params.no_probe,
+        max(4, params.jobs),
+        state,
+        params.retries,
+        params.profile,
+        not params.just_print,
     )
     print(p_color.green("OK!"))
 
+    if params.calibrate:
+        print(p_color.white("Calibrating profiles..."))
+        profile, _ = calibrate(
+            filelist,
+            params.video_preset,
+            thread_budget(1, params.threads),
+            params.sample_seconds,
+            params.calibrate_files,
+            params.target_ratio,
+            params.target_ssim,
+        )
+        if profile is not None and profile != params.profile:
+            params.profile = profile
+            filelist = list_files(
+                params.input_dir,
+                params.output_dir,
+                params.mode,
+                params.audio_preset,
+                params.video_preset,
+                params.input_format,
+                params.output_format,
+                params.limit,
+                not params.no_probe,
+                max(4, params.jobs),
+                state,
+                params.retries,
+                params.profile,
+                not params.just_print,
+            )
+
     if params.just_print:
         tot_bytes = print_filelist(filelist)
         print(p_color.white(f"Total Bytes: {bytes_to_human(tot_bytes)}"))
     else:
+        report = [] if params.report else None
         count, tot_files, tot_bytes_prev, tot_bytes_after = convert_filelist(
-            filelist, params.preserve_files
+            filelist,
+            params.preserve_files,
+            params.jobs,
+            params.threads,
+            state,
+            params.retries,
+            params.progress_interval,
+            report,
         )
+        if params.report:
+            write_report(params.report, report)
         print(
             p_color.white(
                 f"Processed files: {count}/{tot_files}\nPrevious size: {bytes_to_human(tot_bytes_prev)}\nSize after processing: {bytes_to_human(tot_bytes_after)}"
             )
         )
+    if state is not None:
+        state.close()
 
     quit()
 
@@ -1,5 +1,24 @@
 import argparse
+import hashlib
+import json
 import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+try:
+    from pypdf import PdfReader, PdfWriter # type: ignore
+    USE_PYPDF = True
+except ImportError:
+    USE_PYPDF = False
+
+
+logger = logging.getLogger('pdfbatch')
+
+OCR_ENGINES = ['auto', 'ocrmypdf', 'tesseract']
+MANIFEST_FILE = '.pdfbatch-manifest.jsonl'
 
 
 def initialize():
@@ -7,20 +26,375 @@ def initialize():
 
     parser.add_argument('-i', '--input_dir', default='in', help='Directory with input files')
     parser.add_argument('-o', '--output_dir', default='out', help='Directory to output files')
-    parser.add_argument('-t', '--ocr', type=bool, default='False', action='store_true', help='Do OCR in the output file')
+    parser.add_argument('-t', '--ocr', default=False, action='store_true', help='Do OCR in the output file')
+    parser.add_argument('-e', '--engine', choices=OCR_ENGINES, default='auto', help='OCR engine: ocrmypdf, or tesseract with pdftoppm rasterization (default: auto, ocrmypdf when available)')
+    parser.add_argument('-l', '--language', default='eng', help='Tesseract language(s), e.g. eng+por (default: eng)')
+    parser.add_argument('--dpi', type=int, default=300, help='Rasterization resolution for the tesseract engine (default: 300)')
+    parser.add_argument('-w', '--workers', type=int, default=os.cpu_count() or 1, help='OCR worker processes (default: number of CPUs)')
+    parser.add_argument('--window', type=int, default=None, help='Maximum pages split and in flight at a time, bounding memory and temp space (default: 4 x workers)')
+    parser.add_argument('-f', '--force', default=False, action='store_true', help='Process every input, even the ones the manifest says are up to date')
 
     params = parser.parse_args()
 
-
+    if params.window is None:
+        params.window = params.workers * 4
 
     return params
 
-def check_requirements() -> None:
+def setup_logging() -> None:
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
+
+def check_requirements(params) -> None:
     logger.info("Checking requirements...")
+    if not params.ocr:
+        return
+
+    if not USE_PYPDF:
+        logger.error("OCR requires the pypdf module to split pages (pip install pypdf)")
+        sys.exit(1)
+
+    if params.engine == 'auto':
+        params.engine = 'ocrmypdf' if shutil.which('ocrmypdf') else 'tesseract'
+    required = ['ocrmypdf'] if params.engine == 'ocrmypdf' else ['tesseract', 'pdftoppm']
+    # qpdf merges the OCR'd pages from disk, without holding the document in memory
+    required.append('qpdf')
+    missing = [tool for tool in required if shutil.which(tool) is None]
+    if missing:
+        logger.error(f"OCR engine '{params.engine}' requires: {', '.join(missing)}")
+        sys.exit(1)
+    logger.info(f"OCR engine: {params.engine} ({params.language}), {params.workers} workers, window of {params.window} pages")
+
+def list_pdfs(input_dir):
+    """ Input PDFs, largest first, so huge documents start early and small ones fill the gaps """
+    files = []
+    for root, dirs, names in os.walk(input_dir):
+        for name in names:
+            if name.lower().endswith('.pdf'):
+                path = os.path.join(root, name)
+                files.append((os.path.getsize(path), path))
+    return [path for _, path in sorted(files, reverse=True)]
+
+def output_path(pdf_path, input_dir, output_dir):
+    return os.path.join(output_dir, os.path.relpath(pdf_path, input_dir))
+
+def temp_path(out_path):
+    """ Name an output is written to before being renamed into place """
+    parent_dir, name = os.path.split(out_path)
+    return os.path.join(parent_dir, f'.{name}.tmp')
+
+def remove_stale_temp(output_dir):
+    """ Remove temporary outputs left by an interrupted run """
+    removed = 0
+    for root, dirs, names in os.walk(output_dir):
+        for name in names:
+            if name.startswith('.') and name.lower().endswith(('.pdf.tmp', MANIFEST_FILE + '.tmp')):
+                os.remove(os.path.join(root, name))
+                removed += 1
+    if removed:
+        logger.info(f'Removed {removed} temporary files left by an interrupted run')
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def output_options(params):
+    """ Options that change the output; a change in any of them reprocesses every input """
+    if not params.ocr:
+        return {'ocr': False}
+    return {'ocr': True, 'engine': params.engine, 'language': params.language, 'dpi': params.dpi}
+
+class Manifest:
+    """
+    Record of the processed inputs, kept as JSON Lines in the output dir.
+
+    Each finished document appends one line, so an interrupted run keeps
+    everything done up to that point; the last line for an input wins and a
+    torn last line is ignored. compact() rewrites it with one line per input.
+    """
+    def __init__(self, output_dir):
+        self.manifest_file = os.path.join(output_dir, MANIFEST_FILE)
+        self.entries = {}
+        if os.path.exists(self.manifest_file):
+            with open(self.manifest_file, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    self.entries[entry['input']] = entry
+        os.makedirs(output_dir, exist_ok=True)
+        self.journal = open(self.manifest_file, 'a', encoding='utf-8')
+
+    def up_to_date(self, key, pdf_path, out_path, options):
+        """
+        Whether the output of pdf_path is current. Size and mtime are checked
+        first; the content hash is only computed when just the mtime changed,
+        so inputs that were merely touched are not reprocessed either.
+        """
+        entry = self.entries.get(key)
+        if entry is None or entry['options'] != options or not os.path.exists(out_path):
+            return False
+        # Pages that failed OCR are retried on the next run
+        if entry.get('failed', 0) > 0:
+            return False
+        st = os.stat(pdf_path)
+        if entry['size'] != st.st_size:
+            return False
+        if entry['mtime_ns'] == st.st_mtime_ns:
+            return True
+        if entry['sha256'] != file_sha256(pdf_path):
+            return False
+        self.record({**entry, 'mtime_ns': st.st_mtime_ns})
+        return True
+
+    def record(self, entry):
+        self.entries[entry['input']] = entry
+        self.journal.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        self.journal.flush()
+
+    def compact(self, keys=None):
+        """ Rewrite the manifest atomically, keeping only the given inputs (default: all) """
+        self.journal.close()
+        tmp_file = temp_path(self.manifest_file)
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            for key, entry in sorted(self.entries.items()):
+                if keys is None or key in keys:
+                    f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.manifest_file)
+
+def ocr_page(page_pdf, out_pdf, engine, language, dpi):
+    """ OCR a single-page PDF into out_pdf. Runs in a worker process. """
+    # Each worker handles one page; keep the engine itself single-threaded so
+    # the pool doesn't oversubscribe the CPUs
+    env = {**os.environ, 'OMP_THREAD_LIMIT': '1'}
+    if engine == 'ocrmypdf':
+        commands = [['ocrmypdf', '--jobs', '1', '--quiet', '--skip-text', '-l', language, page_pdf, out_pdf]]
+    else:
+        image = os.path.splitext(page_pdf)[0]
+        commands = [
+            ['pdftoppm', '-r', str(dpi), '-png', '-singlefile', page_pdf, image],
+            ['tesseract', image + '.png', os.path.splitext(out_pdf)[0], '-l', language, 'pdf'],
+        ]
+    for command in commands:
+        result = subprocess.run(command, stdin=subprocess.DEVNULL, capture_output=True, env=env)
+        if result.returncode != 0:
+            return False, result.stderr.decode(errors='replace').strip()[-500:]
+    return True, None
+
+class Document:
+    """ A PDF being split into pages and reassembled once all its pages are done """
+    def __init__(self, pdf_path, out_path, work_dir):
+        self.pdf_path = pdf_path
+        self.out_path = out_path
+        self.work_dir = tempfile.mkdtemp(prefix='doc-', dir=work_dir)
+        # Given a path, PdfReader loads the whole file in memory; given a
+        # handle, objects are read from disk as pages are split
+        self.stream = open(pdf_path, 'rb')
+        try:
+            self.reader = PdfReader(self.stream)
+            self.pages = len(self.reader.pages)
+        except Exception:
+            self.close()
+            raise
+        self.next_page = 0
+        self.done = {}
+        self.failed = 0
+
+    def split_next(self):
+        """ Write the next page as a single-page PDF and return its index and path """
+        n = self.next_page
+        page_pdf = os.path.join(self.work_dir, f'{n:06d}.pdf')
+        writer = PdfWriter()
+        writer.add_page(self.reader.pages[n])
+        with open(page_pdf, 'wb') as f:
+            writer.write(f)
+        self.next_page += 1
+        if self.next_page == self.pages:
+            # Everything was split; the source is no longer needed
+            self.close()
+        return n, page_pdf
+
+    def close(self):
+        self.reader = None
+        self.stream.close()
+
+    def discard(self):
+        self.close()
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def finished(self):
+        return len(self.done) == self.pages
+
+    def assemble(self):
+        """ Merge the pages with qpdf, which streams them from disk into the output """
+        os.makedirs(os.path.dirname(self.out_path) or '.', exist_ok=True)
+        # Written under a temporary name and renamed, so an interrupted run
+        # never leaves a truncated output that looks finished
+        tmp_file = temp_path(self.out_path)
+        # Arguments go in a file, as thousands of page paths can exceed the command line limit
+        args_file = os.path.join(self.work_dir, 'qpdf.args')
+        with open(args_file, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(['--empty', '--pages', *(self.done[n] for n in range(self.pages)), '--', tmp_file]) + '\n')
+        result = subprocess.run(['qpdf', f'@{args_file}'], stdin=subprocess.DEVNULL, capture_output=True)
+        # Exit code 3 means it succeeded with warnings
+        if result.returncode not in (0, 3):
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+            raise RuntimeError(result.stderr.decode(errors='replace').strip()[-500:])
+        os.replace(tmp_file, self.out_path)
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+def ocr_documents(pdf_paths, params, on_done=None):
+    """
+    Page-level OCR pipeline over many documents.
+
+    Pages of all documents share one process pool. At most params.window pages
+    are split to disk and in flight at a time, so memory and temp space stay
+    bounded no matter how large the documents are; a document is reassembled
+    as soon as its last page is done, and on_done(pdf_path, out_path, failed
+    pages) is then called. Returns (documents, pages, failed pages).
+    """
+    pdf_paths = iter(pdf_paths)
+    documents = 0
+    pages = 0
+    failed = 0
+    current = None
+    pending = {}
+
+    with tempfile.TemporaryDirectory(prefix='pdfbatch-') as work_dir, \
+            ProcessPoolExecutor(max_workers=params.workers) as executor:
+
+        def next_document():
+            while True:
+                pdf_path = next(pdf_paths, None)
+                if pdf_path is None:
+                    return None
+                try:
+                    doc = Document(pdf_path, output_path(pdf_path, params.input_dir, params.output_dir), work_dir)
+                except Exception as e:
+                    logger.error(f'Could not read "{pdf_path}": {e}')
+                    continue
+                if doc.pages == 0:
+                    logger.warning(f'"{pdf_path}" has no pages')
+                    continue
+                logger.info(f'Processing "{pdf_path}" ({doc.pages} pages)')
+                return doc
+
+        current = next_document()
+        while current is not None or pending:
+            # Fill the window with pages of the current document, then the next ones
+            while current is not None and len(pending) < params.window:
+                try:
+                    n, page_pdf = current.split_next()
+                except Exception as e:
+                    # A malformed page drops its document, not the whole batch
+                    logger.error(f'Could not split page {current.next_page + 1} of "{current.pdf_path}": {e}')
+                    for future, (doc, *_) in list(pending.items()):
+                        if doc is current:
+                            future.cancel()
+                            del pending[future]
+                    current.discard()
+                    current = next_document()
+                    continue
+                out_pdf = os.path.splitext(page_pdf)[0] + '.ocr.pdf'
+                future = executor.submit(ocr_page, page_pdf, out_pdf, params.engine, params.language, params.dpi)
+                pending[future] = (current, n, page_pdf, out_pdf)
+                if current.next_page == current.pages:
+                    current = next_document()
+            if not pending:
+                break
+
+            done, _ = wait(pending.keys(), return_when=FIRST_COMPLETED)
+            for future in done:
+                doc, n, page_pdf, out_pdf = pending.pop(future)
+                try:
+                    ok, error = future.result()
+                except Exception as e:
+                    ok, error = False, str(e)
+                if ok:
+                    doc.done[n] = out_pdf
+                else:
+                    # Keep the original page so the document is still complete
+                    logger.warning(f'OCR failed on page {n + 1} of "{doc.pdf_path}": {error}')
+                    doc.done[n] = page_pdf
+                    doc.failed += 1
+                pages += 1
+
+                if doc.finished():
+                    try:
+                        doc.assemble()
+                        documents += 1
+                        failed += doc.failed
+                        logger.info(f'Done "{doc.out_path}" ({doc.pages} pages, {doc.failed} without OCR)')
+                        if on_done is not None:
+                            on_done(doc.pdf_path, doc.out_path, doc.failed)
+                    except Exception as e:
+                        logger.error(f'Could not write "{doc.out_path}": {e}')
+
+    return documents, pages, failed
+
+def copy_documents(pdf_paths, params, on_done=None):
+    documents = 0
+    for pdf_path in pdf_paths:
+        out_path = output_path(pdf_path, params.input_dir, params.output_dir)
+        os.makedirs(os.path.dirname(out_path) or '.', exist_ok=True)
+        tmp_file = temp_path(out_path)
+        shutil.copy2(pdf_path, tmp_file)
+        os.replace(tmp_file, out_path)
+        logger.info(f'Copied "{pdf_path}" -> "{out_path}"')
+        documents += 1
+        if on_done is not None:
+            on_done(pdf_path, out_path, 0)
+    return documents
 
 def main() -> None:
     params = initialize()
-    check_requirements()
+    setup_logging()
+    check_requirements(params)
+
+    pdf_paths = list_pdfs(params.input_dir)
+    logger.info(f'{len(pdf_paths)} PDF files found in "{params.input_dir}"')
+
+    # Only new or changed inputs (or ones processed with other options) are processed
+    manifest = Manifest(params.output_dir)
+    remove_stale_temp(params.output_dir)
+    options = output_options(params)
+    keys = {pdf_path: os.path.relpath(pdf_path, params.input_dir) for pdf_path in pdf_paths}
+    todo = [pdf_path for pdf_path in pdf_paths
+            if params.force or not manifest.up_to_date(
+                keys[pdf_path], pdf_path, output_path(pdf_path, params.input_dir, params.output_dir), options)]
+    logger.info(f'{len(pdf_paths) - len(todo)} up to date, {len(todo)} to process')
+
+    def on_done(pdf_path, out_path, failed):
+        st = os.stat(pdf_path)
+        manifest.record({
+            'input': keys[pdf_path],
+            'sha256': file_sha256(pdf_path),
+            'size': st.st_size,
+            'mtime_ns': st.st_mtime_ns,
+            'options': options,
+            'output': os.path.relpath(out_path, params.output_dir),
+            'failed': failed,
+        })
+
+    try:
+        if params.ocr:
+            documents, pages, failed = ocr_documents(todo, params, on_done)
+            logger.info(f'{documents} documents, {pages} pages processed, {failed} pages without OCR')
+        else:
+            documents = copy_documents(todo, params, on_done)
+            logger.info(f'{documents} documents copied')
+    finally:
+        # Inputs that no longer exist are dropped from the manifest
+        manifest.compact(set(keys.values()))
 
     quit()
-main()
\ No newline at end of file
+
+# Worker processes import this module, so main() must only run as a script
+if __name__ == '__main__':
+    main()
@@ -1,43 +1,375 @@
 import argparse
+import glob
 import hashlib
+import json
+import mmap
+import os
+import sqlite3
+import sys
+import time
+import urllib.parse
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from importlib.metadata import version
 from pyhanko.pdf_utils.reader import PdfFileReader # type: ignore
 
-def print_sign_metadata(pdf_path):
+DIGEST_CHUNK_SIZE = 1024 * 1024
+CACHE_DIR = os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')), 'signchecker')
+CACHE_MAX_MB = 256
+# Results of a different pyhanko version may differ, so it is part of the cache key
+PYHANKO_VERSION = version('pyhanko')
+
+def byte_ranges(sig_obj):
+    # /ByteRange is [offset1 length1 offset2 length2 ...]; returns [(start, end), ...]
+    br = [int(v) for v in sig_obj.sig_object['/ByteRange']]
+    return [(br[i], br[i] + br[i + 1]) for i in range(0, len(br), 2)]
+
+def digest_byte_ranges(f, range_lists, alg='sha256', chunk_size=DIGEST_CHUNK_SIZE):
+    """
+    Hash the signed byte ranges of several signatures straight from the file.
+
+    The file is mapped and walked once, in order, feeding each segment to
+    every signature that covers it, so a prefix shared by several signatures
+    (incremental updates) is read a single time. Only memoryview slices of
+    the map are passed to hashlib, so memory use does not grow with the file.
+    Returns one hex digest per range list, or an exception for ranges that
+    fall outside the file.
+    """
+    hashers = [hashlib.new(alg) for _ in range_lists]
+    size = os.fstat(f.fileno()).st_size
+    results = [None] * len(range_lists)
+    for n, ranges in enumerate(range_lists):
+        if any(start < 0 or end < start or end > size for start, end in ranges):
+            results[n] = ValueError(f'/ByteRange {ranges} is outside the file ({size} bytes)')
+    valid = [n for n, result in enumerate(results) if result is None]
+
+    bounds = sorted({p for n in valid for r in range_lists[n] for p in r})
+    if len(bounds) > 1:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if hasattr(mm, 'madvise'):
+                mm.madvise(mmap.MADV_SEQUENTIAL)
+            view = memoryview(mm)
+            try:
+                for start, end in zip(bounds, bounds[1:]):
+                    covering = [hashers[n] for n in valid
+                                if any(s <= start and end <= e for s, e in range_lists[n])]
+                    for pos in range(start, end, chunk_size):
+                        chunk = view[pos:min(end, pos + chunk_size)]
+                        for h in covering:
+                            h.update(chunk)
+                        chunk.release()
+            finally:
+                view.release()
+
+    for n in valid:
+        results[n] = hashers[n].hexdigest()
+    return results
+
+def read_sign_metadata(pdf_path):
+    # Never raises: a bad PDF is reported in 'status'/'error' so a batch can go on
+    result = {'file': pdf_path, 'status': 'ok', 'signatures': []}
+    try:
+        with open(pdf_path, 'rb') as f:
+            reader = PdfFileReader(f)
+            sigs = reader.embedded_signatures
+
+            if not sigs:
+                result['status'] = 'unsigned'
+                return result
+
+            # Signed content of all signatures, hashed in a single pass over the file
+            range_lists = []
+            for sig_obj in sigs:
+                try:
+                    range_lists.append(byte_ranges(sig_obj))
+                except Exception as e:
+                    range_lists.append(e)
+            computed = iter(digest_byte_ranges(f, [r for r in range_lists if not isinstance(r, Exception)]))
+            digests = [r if isinstance(r, Exception) else next(computed) for r in range_lists]
+
+            for i, (sig_obj, signed_hash) in enumerate(zip(sigs, digests), start=1):
+                try:
+                    # Retrieve the signer name
+                    signer_name = sig_obj.signer_cert.subject.native.get("common_name", "(Name not found)")
+
+                    # Try to get sign date and time, if available
+                    signing_time = None
+                    if sig_obj.self_reported_timestamp:
+                        signing_time = sig_obj.self_reported_timestamp.isoformat()
+
+                    # Hash (SHA-256) of the signed byte ranges
+                    if isinstance(signed_hash, Exception):
+                        raise signed_hash
+
+                    result['signatures'].append({
+                        'index': i,
+                        'signer': signer_name,
+                        'timestamp': signing_time,
+                        'digest': signed_hash,
+                    })
+                except Exception as e:
+                    result['status'] = 'partial'
+                    result['signatures'].append({'index': i, 'error': str(e)})
+    except Exception as e:
+        result['status'] = 'error'
+        result['error'] = f'{type(e).__name__}: {e}'
+    return result
+
+def content_key(pdf_path):
+    # Content-addressed key: the same PDF hits the cache wherever it is moved to
     with open(pdf_path, 'rb') as f:
-        reader = PdfFileReader(f)
-        sigs = reader.embedded_signatures
+        size = os.fstat(f.fileno()).st_size
+        digest = digest_byte_ranges(f, [[(0, size)]])[0]
+    return f'{digest}:{size}:{PYHANKO_VERSION}'
 
-        if not sigs:
-            print("No signs found.")
+class ResultCache:
+    """
+    Signature metadata of already checked PDFs, in a SQLite file under the
+    cache directory, keyed by content hash, size and pyhanko version.
+
+    Only the main process writes. Batch workers open it read-only, so a hit
+    skips parsing entirely. Least recently used entries are evicted when the
+    stored metadata exceeds max_mb.
+    """
+    def __init__(self, cache_dir=CACHE_DIR, max_mb=CACHE_MAX_MB, refresh=False, readonly=False):
+        self.db_file = os.path.join(cache_dir, 'results.sqlite')
+        self.max_bytes = max_mb * 1024 * 1024
+        self.refresh = refresh
+        self.readonly = readonly
+        if readonly:
+            uri = 'file:{}?mode=ro'.format(urllib.parse.quote(os.path.abspath(self.db_file)))
+            self.conn = sqlite3.connect(uri, uri=True)
             return
+        os.makedirs(cache_dir, exist_ok=True)
+        self.conn = sqlite3.connect(self.db_file)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS results ('
+            'key TEXT PRIMARY KEY, metadata TEXT NOT NULL, bytes INTEGER NOT NULL, last_used REAL NOT NULL)'
+        )
+        self.conn.execute('CREATE INDEX IF NOT EXISTS idx_results_last_used ON results (last_used)')
+        self.conn.commit()
 
-        for i, sig_obj in enumerate(sigs, start=1):
-            try:
-                # Retrieve the signer name
-                signer_name = sig_obj.signer_cert.subject.native.get("common_name", "(Name not found)")
+    def get(self, key):
+        if self.refresh:
+            return None
+        row = self.conn.execute('SELECT metadata FROM results WHERE key = ?', (key,)).fetchone()
+        return json.loads(row[0]) if row else None
 
-                # Try to get sign date and time, if available
-                if sig_obj.self_reported_timestamp:
-                    signing_time = sig_obj.self_reported_timestamp.isoformat()
-                else:
-                    signing_time = "(date is not available)"
+    def touch(self, key):
+        self.conn.execute('UPDATE results SET last_used = ? WHERE key = ?', (time.time(), key))
+
+    def put(self, key, result):
+        # Errors may come from the environment (permissions, I/O), not the content
+        if result['status'] == 'error':
+            return
+        metadata = json.dumps({k: v for k, v in result.items() if k not in ('file', 'cached')}, ensure_ascii=False)
+        self.conn.execute(
+            'INSERT OR REPLACE INTO results (key, metadata, bytes, last_used) VALUES (?, ?, ?, ?)',
+            (key, metadata, len(metadata), time.time()),
+        )
 
-                # Generate hash of the signed data
-                signed_data = bytes(sig_obj.signed_data)
-                signed_hash = hashlib.sha256(signed_data).hexdigest()
+    def evict(self):
+        total = self.conn.execute('SELECT COALESCE(SUM(bytes), 0) FROM results').fetchone()[0]
+        if total <= self.max_bytes:
+            return 0
+        evicted = 0
+        for key, size in self.conn.execute('SELECT key, bytes FROM results ORDER BY last_used').fetchall():
+            if total <= self.max_bytes:
+                break
+            self.conn.execute('DELETE FROM results WHERE key = ?', (key,))
+            total -= size
+            evicted += 1
+        return evicted
 
-                print(f"Sign #{i}:")
-                print(f"  Signer Name: {signer_name}")
-                print(f"  Sign Date/Time: {signing_time}")
-                print(f"  Hash (SHA-256): {signed_hash}\n")
+    def close(self):
+        if not self.readonly:
+            self.evict()
+            self.conn.commit()
+        self.conn.close()
 
-            except Exception as e:
-                print(f"Error processing sign #{i}: {e}")
+# Read-only cache connection of each worker process, opened on first use
+_worker_cache = None
+
+def check_file(pdf_path, cache_dir=None, refresh=False):
+    """
+    Return (result, cache key, hit) for one PDF. With a cache directory the
+    content key is computed first and a cached result is served without
+    parsing; writing the cache is left to the caller.
+    """
+    global _worker_cache
+    if cache_dir is None:
+        return read_sign_metadata(pdf_path), None, False
+    try:
+        key = content_key(pdf_path)
+    except OSError:
+        return read_sign_metadata(pdf_path), None, False
+    if not refresh:
+        try:
+            if _worker_cache is None:
+                _worker_cache = ResultCache(cache_dir, readonly=True)
+            cached = _worker_cache.get(key)
+        except sqlite3.Error:
+            cached = None
+        if cached is not None:
+            return {'file': pdf_path, **cached, 'cached': True}, key, True
+    return {**read_sign_metadata(pdf_path), 'cached': False}, key, False
+
+def print_sign_metadata(pdf_path, cache=None):
+    if cache is None:
+        result = read_sign_metadata(pdf_path)
+    else:
+        try:
+            key = content_key(pdf_path)
+        except OSError:
+            key = None
+        result = cache.get(key) if key else None
+        if result is None:
+            result = read_sign_metadata(pdf_path)
+            if key:
+                cache.put(key, result)
+        elif key:
+            cache.touch(key)
+
+    if result['status'] == 'error':
+        print(f"Error reading {pdf_path}: {result['error']}")
+        return
+
+    if not result['signatures']:
+        print("No signs found.")
+        return
+
+    for sig in result['signatures']:
+        if 'error' in sig:
+            print(f"Error processing sign #{sig['index']}: {sig['error']}")
+            continue
+        print(f"Sign #{sig['index']}:")
+        print(f"  Signer Name: {sig['signer']}")
+        print(f"  Sign Date/Time: {sig['timestamp'] or '(date is not available)'}")
+        print(f"  Hash (SHA-256): {sig['digest']}\n")
+
+def list_pdfs(inputs):
+    # Directories are walked recursively; other inputs are glob patterns or files
+    for item in inputs:
+        if os.path.isdir(item):
+            for root, dirs, files in os.walk(item):
+                dirs.sort()
+                for name in sorted(files):
+                    if name.lower().endswith('.pdf'):
+                        yield os.path.join(root, name)
+        elif glob.has_magic(item):
+            yield from sorted(glob.iglob(item, recursive=True))
+        else:
+            yield item
+
+def check_batch(files, output, workers=None, cache=None):
+    """
+    Verify many PDFs in a process pool, writing one JSON line per file as
+    soon as it is done (not in input order). Returns the status counters.
+
+    When a worker dies, every file that was in flight is a suspect: they are
+    rerun one at a time in a fresh pool, so only a file that crashes again
+    on its own is reported as an error.
+    """
+    workers = workers or os.cpu_count() or 1
+    # Bounded number of files in flight, so huge batches don't queue millions of futures
+    window = workers * 4
+    files = iter(files)
+    suspects = deque()
+    counters = {'files': 0, 'ok': 0, 'unsigned': 0, 'partial': 0, 'error': 0, 'cache_hits': 0, 'cache_lookups': 0}
+    cache_dir = os.path.dirname(cache.db_file) if cache else None
+    refresh = cache.refresh if cache else False
+    start = time.perf_counter()
+
+    executor = ProcessPoolExecutor(max_workers=workers)
+    pending = {}
+    try:
+        while True:
+            if suspects:
+                if not pending:
+                    pdf_path = suspects.popleft()
+                    pending[executor.submit(check_file, pdf_path, cache_dir, refresh)] = (pdf_path, True)
+            else:
+                while len(pending) < window:
+                    pdf_path = next(files, None)
+                    if pdf_path is None:
+                        break
+                    pending[executor.submit(check_file, pdf_path, cache_dir, refresh)] = (pdf_path, False)
+            if not pending:
+                break
+
+            done, _ = wait(pending.keys(), return_when=FIRST_COMPLETED)
+            broken = False
+            for future in done:
+                pdf_path, isolated = pending.pop(future)
+                key, hit = None, False
+                try:
+                    result, key, hit = future.result()
+                except BrokenProcessPool:
+                    broken = True
+                    if not isolated:
+                        suspects.append(pdf_path)
+                        continue
+                    # It crashed a worker again while running alone (e.g. out of memory)
+                    result = {'file': pdf_path, 'status': 'error', 'signatures': [], 'error': 'worker process crashed'}
+                except Exception as e:
+                    result = {'file': pdf_path, 'status': 'error', 'signatures': [], 'error': f'{type(e).__name__}: {e}'}
+
+                counters['files'] += 1
+                counters[result['status']] += 1
+                if cache is not None and key is not None:
+                    counters['cache_lookups'] += 1
+                    if hit:
+                        counters['cache_hits'] += 1
+                        cache.touch(key)
+                    else:
+                        cache.put(key, result)
+                output.write(json.dumps(result, ensure_ascii=False) + '\n')
+            output.flush()
+            if cache is not None:
+                cache.conn.commit()
+
+            if broken:
+                # The whole pool is dead: everything still in flight is lost and
+                # rerun, and a single new pool replaces it
+                suspects.extend(pdf_path for pdf_path, _ in pending.values())
+                pending.clear()
+                executor.shutdown(wait=False, cancel_futures=True)
+                executor = ProcessPoolExecutor(max_workers=workers)
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+    counters['seconds'] = time.perf_counter() - start
+    return counters
+
+def print_summary(counters):
+    seconds = counters['seconds']
+    rate = counters['files'] / seconds if seconds > 0 else 0.0
+    print(
+        f"Checked {counters['files']} files in {seconds:.2f}s ({rate:.1f} files/s): "
+        f"{counters['ok']} ok, {counters['unsigned']} unsigned, "
+        f"{counters['partial']} partial, {counters['error']} errors",
+        file=sys.stderr,
+    )
+    if counters['cache_lookups']:
+        hit_rate = counters['cache_hits'] / counters['cache_lookups']
+        print(f"Cache: {counters['cache_hits']}/{counters['cache_lookups']} hits ({hit_rate:.1%})", file=sys.stderr)
 
 def parse_args():
     parser = argparse.ArgumentParser('PDF PAdES sign checker')
 
-    parser.add_argument('-i', '--input_file', required=True, help='File to verify')
+    inputs = parser.add_mutually_exclusive_group(required=True)
+    inputs.add_argument('-i', '--input_file', help='File to verify')
+    inputs.add_argument('-b', '--batch', nargs='+', metavar='PATH', help='Directories (searched recursively for *.pdf), glob patterns or files to verify in batch')
+    parser.add_argument('-o', '--output', default='-', help='JSON Lines output for batch mode (default: stdout)')
+    parser.add_argument('-w', '--workers', type=int, default=None, help='Worker processes for batch mode (default: number of CPUs)')
+    parser.add_argument('--cache-dir', default=CACHE_DIR, help=f'Directory of the result cache (default: {CACHE_DIR})')
+    parser.add_argument('--cache-max-mb', type=int, default=CACHE_MAX_MB, help=f'Size bound of the cached metadata in MB; least recently used entries are evicted (default: {CACHE_MAX_MB})')
+    cache = parser.add_mutually_exclusive_group()
+    cache.add_argument('--no-cache', action='store_true', help='Neither read nor write the result cache')
+    cache.add_argument('--refresh', action='store_true', help='Ignore cached results and re-check every file, updating the cache')
 
     params = parser.parse_args()
 
@@ -45,7 +377,27 @@ def parse_args():
 
 def main() -> None:
     params = parse_args()
-    print_sign_metadata(params.input_file)
+
+    cache = None
+    if not params.no_cache:
+        cache = ResultCache(params.cache_dir, params.cache_max_mb, params.refresh)
+
+    try:
+        if params.batch:
+            if params.output == '-':
+                counters = check_batch(list_pdfs(params.batch), sys.stdout, params.workers, cache)
+            else:
+                with open(params.output, 'w', encoding='utf-8') as output:
+                    counters = check_batch(list_pdfs(params.batch), output, params.workers, cache)
+            print_summary(counters)
+        else:
+            print_sign_metadata(params.input_file, cache)
+    finally:
+        if cache is not None:
+            cache.close()
 
     quit()
-main()
+
+# Worker processes import this module, so main() must only run as a script
+if __name__ == '__main__':
+    main()